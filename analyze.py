@@ -1,40 +1,19 @@
 import sys
 import os
-import matplotlib.pyplot as plt
 import numpy as np
+from utils.scores import load_scores
 
 def calculate_average_max(filename, group_size=100, lines_to_include=None):
-    max_values = []
-    current_group = []
-    lines_processed = 0
-    
-    with open(filename, 'r') as file:
-        for line in file:
-            if lines_to_include is not None and lines_processed >= lines_to_include:
-                break
-            
-            try:
-                number = float(line.strip())
-                current_group.append(number)
-                lines_processed += 1
-                
-                if len(current_group) == group_size:
-                    max_values.append(max(current_group))
-                    current_group = []
-            except ValueError:
-                continue  # Skip non-numeric lines
-    
-    # Handle any remaining numbers
-    if current_group:
-        max_values.append(max(current_group))
-    
-    if max_values:
-        average_max = sum(max_values) / len(max_values)
-        return average_max
-    else:
+    scores = load_scores(filename)[:lines_to_include]
+    if not len(scores):
         return 0
+    # Max of every group of group_size scores, including a trailing partial group
+    max_values = np.maximum.reduceat(scores.astype(np.float64), np.arange(0, len(scores), group_size))
+    return float(max_values.mean())
 
 if __name__ == "__main__":
+    import matplotlib.pyplot as plt
+
     directory = '/Users/vijaykumaravelrajan/Downloads/eval_data_gpt-4o'
     results = {}
     group_size = 1  # Default group size, can be changed here
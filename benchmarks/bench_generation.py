@@ -0,0 +1,240 @@
+"""
+Throughput and latency benchmarks for the generation path against the local mock OpenRouter server.
+
+Each shape runs generate_language for every target language (or generate_languages for
+groups of them, in multi-target shapes) on one event loop with one shared LLM, as
+driver.py --in_process does, against a freshly started mock server:
+    python -m benchmarks.bench_generation --shape smoke
+    python -m benchmarks.bench_generation --shape pass100_full --rate_limit_rps 300 --json results.json
+    python -m benchmarks.bench_generation --shape all --baseline results.json --tolerance 0.15
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import asyncio
+import argparse
+import tempfile
+import subprocess
+import statistics
+import urllib.request
+from typing import Dict, Any, List, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.mock_openrouter import add_arguments
+from utils.config import Config
+from utils.scheduler import get_limiter, limiter_settings, provider_of
+from models import LLM, LLMCallsFailed, close_http_client
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# (target languages, source lines, passes, samples per request, source lines per request, target languages per request)
+SHAPES = {
+    'smoke': (1, 10, 10, 10, 1, 1),
+    'pass1_full': (23, 50, 1, 1, 1, 1),
+    'pass1_full_packed': (23, 50, 1, 1, 10, 1),
+    'pass10_full': (23, 50, 10, 10, 1, 1),
+    'pass10_full_multi': (23, 50, 10, 10, 1, 23),
+    'pass100_full': (23, 50, 100, 100, 1, 1),
+    'pass100_full_single': (23, 50, 100, 1, 1, 1),
+}
+
+class TimedLLM(LLM):
+    """LLM that records request latency, limiter queue wait and successful requests"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.latencies: List[float] = []
+        self.queue_waits: List[float] = []
+        self.successes = 0
+
+    async def _create(self, **kwargs):
+        start = time.monotonic()
+        completion, headers, latency = await super()._create(**kwargs)
+        self.latencies.append(latency)
+        self.queue_waits.append(time.monotonic() - start - latency)
+        return completion, headers, latency
+
+    async def _make_sample_call(self, *args, **kwargs):
+        result = await super()._make_sample_call(*args, **kwargs)
+        self.successes += 1
+        return result
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method='inclusive')[int(q) - 1]
+
+def start_mock_server(args: argparse.Namespace, port: int) -> subprocess.Popen:
+    command = [
+        sys.executable, "-m", "benchmarks.mock_openrouter",
+        "--port", str(port),
+        "--latency", args.latency,
+        "--rate_limit_rps", str(args.rate_limit_rps),
+        "--rate_limit_prob", str(args.rate_limit_prob),
+        "--rate_limit_style", args.rate_limit_style,
+        "--error_prob", str(args.error_prob),
+        "--refusal_prob", str(args.refusal_prob),
+        "--max_n", str(args.max_n),
+        "--pack_miss_prob", str(args.pack_miss_prob),
+        "--seed", str(args.seed),
+    ]
+    server = subprocess.Popen(command, cwd=REPO_ROOT, stdout=subprocess.PIPE, text=True)
+    server.stdout.readline()  # Wait for the listening line
+    return server
+
+def make_config(workspace: str, shape: str, max_concurrency: int) -> Config:
+    """Repo config with synthetic FLORES input, no cache and a `benchmark` experiment of the given shape"""
+    num_languages, num_lines, passes, samples_per_request, pack_size, languages_per_request = SHAPES[shape]
+    flores = os.path.join(workspace, 'devtest')
+    os.makedirs(flores, exist_ok=True)
+    in_file = os.path.join(flores, 'devtest.eng_Latn')
+    with open(in_file, 'w', encoding='utf-8') as f:
+        f.write("\n".join(f"Benchmark source sentence {i} with a handful of ordinary words." for i in range(num_lines)))
+
+    config = Config(os.path.join(REPO_ROOT, 'config'))
+    config.base['paths']['base_flores'] = flores
+    config.base['cache'] = {'enabled': False}
+    config.base['concurrency']['max_in_flight'] = max_concurrency
+    strategy = dict(config.experiments['strategies']['pass@1-vanilla'])
+    strategy.update({'passes': passes, 'samples_per_request': samples_per_request, 'pack_size': pack_size,
+                     'languages_per_request': languages_per_request, 'temperature': 1.0})
+    config.experiments['strategies']['benchmark'] = strategy
+    config.experiments['experiments']['benchmark'] = {
+        'model': 'gpt4o_mini',
+        'num_lines': num_lines,
+        'strategy': 'benchmark',
+        'target_languages': config.experiments['language_groups']['full'][:num_languages],
+        'source_language': 'English',
+        'in_file': in_file,
+    }
+    return config
+
+async def run_shape(config: Config, shape: str, workspace: str) -> Tuple[TimedLLM, int]:
+    """Run every language of the shape, returning the LLM and the number of calls that failed for good"""
+    from generate import generate_language, generate_languages
+
+    experiment_config = config.get_experiment_config('benchmark')
+    api_name = config.get_model_config(experiment_config['model'])['api_name']
+    llm = TimedLLM(api_name, limiter=get_limiter(f"benchmark-{shape}", **limiter_settings(config.base['concurrency'], provider_of(api_name))), http_settings=config.base.get('http'))
+    languages = experiment_config['target_languages']
+    group_size = SHAPES[shape][5]
+    try:
+        if group_size > 1:
+            groups = [languages[k:k + group_size] for k in range(0, len(languages), group_size)]
+            failed = await asyncio.gather(*(
+                generate_languages(config, 'benchmark', {language: os.path.join(workspace, f"{language}.txt") for language in group}, llm=llm)
+                for group in groups
+            ))
+            outcomes = [next((errors[language] for errors in failed if language in errors), None) for language in languages]
+        else:
+            outcomes = await asyncio.gather(*(
+                generate_language(config, 'benchmark', os.path.join(workspace, f"{language}.txt"), language, llm=llm)
+                for language in languages
+            ), return_exceptions=True)
+    finally:
+        await close_http_client()
+    # Failed calls (--error_prob, --refusal_prob) are part of the measurement; anything else is a bug
+    failed = 0
+    for language, outcome in zip(languages, outcomes):
+        if isinstance(outcome, LLMCallsFailed):
+            print(f"{shape}: {language}: {len(outcome.failures)} call(s) failed", file=sys.stderr)
+            failed += len(outcome.failures)
+        elif isinstance(outcome, BaseException):
+            raise outcome
+    return llm, failed
+
+def benchmark(args: argparse.Namespace, shape: str, port: int) -> Dict[str, Any]:
+    server = start_mock_server(args, port)
+    workspace = tempfile.mkdtemp(prefix=f"bench_{shape}_")
+    os.environ['OPENROUTER_BASE_URL'] = f"http://127.0.0.1:{port}/api/v1"
+    os.environ.setdefault('OPENROUTER_API_KEY', 'mock')
+    stdout = sys.stdout
+    try:
+        config = make_config(workspace, shape, args.max_concurrency)
+        start = time.monotonic()
+        if not args.verbose:
+            sys.stdout = open(os.devnull, 'w')
+        llm, failed = asyncio.run(run_shape(config, shape, workspace))
+        wall_time = time.monotonic() - start
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/api/v1/stats") as response:
+            stats = json.load(response)
+    finally:
+        if sys.stdout is not stdout:
+            sys.stdout.close()
+            sys.stdout = stdout
+        server.terminate()
+        server.wait()
+        shutil.rmtree(workspace, ignore_errors=True)
+
+    num_languages, num_lines, passes = SHAPES[shape][:3]
+    return {
+        'shape': shape,
+        'samples': num_languages * num_lines * passes,
+        'requests': stats['requests'],
+        'requests_per_sec': stats['requests'] / wall_time,
+        'samples_per_sec': num_languages * num_lines * passes / wall_time,
+        'p50_latency': percentile(llm.latencies, 50),
+        'p95_latency': percentile(llm.latencies, 95),
+        'p99_latency': percentile(llm.latencies, 99),
+        'p95_queue_wait': percentile(llm.queue_waits, 95),
+        'retries': stats['requests'] - llm.successes,
+        'failed': failed,
+        'rate_limited': stats['rate_limited'],
+        'peak_in_flight': stats['peak_in_flight'],
+        'wall_time': wall_time,
+    }
+
+def print_report(results: List[Dict[str, Any]]) -> None:
+    columns = ['shape', 'samples', 'requests', 'requests_per_sec', 'p50_latency', 'p95_latency', 'p99_latency',
+               'p95_queue_wait', 'retries', 'failed', 'rate_limited', 'peak_in_flight', 'wall_time']
+    print(" | ".join(columns))
+    for result in results:
+        print(" | ".join(f"{result[c]:.3f}" if isinstance(result[c], float) else str(result[c]) for c in columns))
+
+def check_regressions(results: List[Dict[str, Any]], baseline_file: str, tolerance: float) -> List[str]:
+    with open(baseline_file, 'r') as f:
+        baseline = {result['shape']: result for result in json.load(f)}
+    regressions = []
+    for result in results:
+        base = baseline.get(result['shape'])
+        if base is None:
+            continue
+        if result['wall_time'] > base['wall_time'] * (1 + tolerance):
+            regressions.append(f"{result['shape']}: wall time {result['wall_time']:.2f}s vs baseline {base['wall_time']:.2f}s")
+        if result['requests'] > base['requests'] * (1 + tolerance):
+            regressions.append(f"{result['shape']}: {result['requests']} requests vs baseline {base['requests']}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the generation path against a mock OpenRouter server")
+    parser.add_argument("--shape", choices=list(SHAPES) + ['all'], default='smoke')
+    parser.add_argument("--max_concurrency", type=int, default=64, help="Ceiling of the adaptive in-flight limit")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--json", help="Write results to this JSON file")
+    parser.add_argument("--baseline", help="JSON results to compare against; exits non-zero on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="Allowed relative slowdown against --baseline")
+    parser.add_argument("--verbose", action="store_true", help="Show generation output")
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    shapes = list(SHAPES) if args.shape == 'all' else [args.shape]
+    results = [benchmark(args, shape, args.port) for shape in shapes]
+    print_report(results)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        regressions = check_regressions(results, args.baseline, args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        if regressions:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
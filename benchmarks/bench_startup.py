@@ -0,0 +1,73 @@
+"""
+Cold-start benchmark for the entry points that are started many times per run.
+
+Each command runs in a fresh interpreter from the repository root, with the config cache
+removed before every run (cold) or left in place (warm), and the heavy modules each one
+ends up importing are reported:
+    python -m benchmarks.bench_startup
+    python -m benchmarks.bench_startup --runs 20 --json startup.json
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import subprocess
+import statistics
+from typing import Dict, Any, List
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY_MODULES = ['openai', 'httpx', 'numpy', 'matplotlib', 'yaml']
+
+# name: Python code run in a fresh interpreter
+COMMANDS = {
+    # What `python driver.py --list` does
+    'driver --list': "import sys; sys.argv = ['driver.py', '--list']; import driver; driver.main()",
+    # A generate.py language worker up to its first request
+    'generate worker': "import generate; from utils.config import Config; Config()",
+    'evaluate': "import evaluate; from utils.config import Config; Config()",
+}
+
+def run_once(code: str, cold: bool) -> float:
+    if cold:
+        shutil.rmtree(os.path.join(REPO_ROOT, 'config', '.cache'), ignore_errors=True)
+    start = time.perf_counter()
+    subprocess.run([sys.executable, '-c', code], cwd=REPO_ROOT, check=True, stdout=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+def imported_modules(code: str) -> List[str]:
+    probe = f"{code}\nimport sys; print('IMPORTED', *(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    output = subprocess.run([sys.executable, '-c', probe], cwd=REPO_ROOT, check=True, capture_output=True, text=True).stdout
+    return [line for line in output.splitlines() if line.startswith('IMPORTED')][-1].split()[1:]
+
+def benchmark(name: str, code: str, runs: int) -> Dict[str, Any]:
+    run_once(code, cold=False)  # Fill the config cache, so imports are those of a warm start
+    result = {'command': name, 'imports': imported_modules(code)}
+    for mode in ('cold', 'warm'):
+        run_once(code, cold=False)  # Let the OS cache the interpreter and modules
+        times = [run_once(code, cold=mode == 'cold') for _ in range(runs)]
+        result[f'{mode}_median_ms'] = 1000 * statistics.median(times)
+        result[f'{mode}_min_ms'] = 1000 * min(times)
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure cold start of driver.py --list and generation workers")
+    parser.add_argument("--runs", type=int, default=10, help="Runs per command and mode")
+    parser.add_argument("--json", help="Write results to this JSON file")
+    args = parser.parse_args()
+
+    results = []
+    for name, code in COMMANDS.items():
+        result = benchmark(name, code, args.runs)
+        results.append(result)
+        print(f"{name:16} cold {result['cold_median_ms']:7.1f} ms (min {result['cold_min_ms']:.1f})  "
+              f"warm {result['warm_median_ms']:7.1f} ms (min {result['warm_min_ms']:.1f})  "
+              f"imports: {', '.join(result['imports']) or '-'}")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
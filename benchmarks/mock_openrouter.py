@@ -0,0 +1,235 @@
+"""
+Local stand-in for the OpenRouter chat completions API, for load testing without spending money.
+
+Run it on its own:
+    python -m benchmarks.mock_openrouter --port 8765 --latency lognormal:-2.5,0.5 --rate_limit_rps 200
+
+and point the generation pipeline at it with OPENROUTER_BASE_URL=http://127.0.0.1:8765/api/v1.
+"""
+import re
+import json
+import time
+import random
+import asyncio
+import argparse
+from typing import Dict, Any, Tuple
+
+NUMBERED_LINE = re.compile(r'^(\d+)\. (.*)$', re.MULTILINE)
+# The language list of utils.packing.DEFAULT_MULTI_TARGET_TEMPLATE
+TARGET_LANGUAGES = re.compile(r'into each of these languages: (.*?)\.\n')
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 429: "Too Many Requests"}
+
+def parse_latency(spec: str):
+    """
+    Parse a latency distribution spec into a function returning seconds.
+
+    constant:S, uniform:LO,HI, normal:MEAN,STD or lognormal:MU,SIGMA (of the natural log of seconds)
+    """
+    kind, _, params = spec.partition(':')
+    values = [float(v) for v in params.split(',')] if params else []
+    if kind == 'constant':
+        return lambda: values[0]
+    if kind == 'uniform':
+        return lambda: random.uniform(values[0], values[1])
+    if kind == 'normal':
+        return lambda: max(0.0, random.gauss(values[0], values[1]))
+    if kind == 'lognormal':
+        return lambda: random.lognormvariate(values[0], values[1])
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+class MockOpenRouter:
+    """
+    OpenAI-compatible /chat/completions endpoint with configurable latency and failure injection.
+
+    Rate limits come from a fixed one-second window of `rate_limit_rps` requests and from
+    random injection with probability `rate_limit_prob`. They are returned either as an HTTP 429
+    or, like OpenRouter, as a 200 whose body holds an `error` with X-RateLimit-* metadata.
+    Requests in JSON mode are answered with a JSON object translating each numbered line of the
+    prompt, as packed requests ask for, or keyed by language name when the prompt asks for
+    several target languages, as multi-target requests do; each line or language is left out
+    with probability `pack_miss_prob`.
+    """
+
+    def __init__(
+        self,
+        latency: str = "constant:0.05",
+        rate_limit_rps: int = 0,
+        rate_limit_prob: float = 0.0,
+        rate_limit_style: str = "mixed",
+        error_prob: float = 0.0,
+        refusal_prob: float = 0.0,
+        max_n: int = 128,
+        pack_miss_prob: float = 0.0,
+        seed: int = 0,
+    ):
+        self.latency = parse_latency(latency)
+        self.rate_limit_rps = rate_limit_rps
+        self.rate_limit_prob = rate_limit_prob
+        self.rate_limit_style = rate_limit_style
+        self.error_prob = error_prob
+        self.refusal_prob = refusal_prob
+        self.max_n = max_n
+        self.pack_miss_prob = pack_miss_prob
+        self.random = random.Random(seed)
+        self.window_start = int(time.time())
+        self.window_count = 0
+        self.stats = {'requests': 0, 'completions': 0, 'rate_limited': 0, 'errors': 0, 'refusals': 0, 'pack_misses': 0, 'in_flight': 0, 'peak_in_flight': 0}
+
+    def _rate_limit_headers(self, remaining: int) -> Dict[str, str]:
+        return {
+            'X-RateLimit-Limit': str(self.rate_limit_rps or 1000000),
+            'X-RateLimit-Remaining': str(max(0, remaining)),
+            'X-RateLimit-Reset': str((self.window_start + 1) * 1000),
+        }
+
+    def _rate_limited(self, headers: Dict[str, str]) -> Tuple[int, Dict[str, str], Dict[str, Any]]:
+        self.stats['rate_limited'] += 1
+        error = {'message': 'Rate limit exceeded', 'code': 429, 'metadata': {'headers': headers}}
+        style = self.rate_limit_style
+        if style == 'mixed':
+            style = self.random.choice(['status', 'body'])
+        if style == 'status':
+            return 429, headers, {'error': error}
+        return 200, {}, {'error': error}
+
+    def _json_reply(self, prompt: str) -> str:
+        languages = TARGET_LANGUAGES.search(prompt)
+        if languages:
+            source = prompt[languages.end():].strip().split("\n")[0]
+            entries = [(language, f"mock {language} translation {self.random.randint(0, 9)} of {source[-60:]!r}")
+                       for language in languages.group(1).split(", ")]
+        else:
+            entries = [(number, f"mock translation {self.random.randint(0, 9)} of {line[-60:]!r}")
+                       for number, line in NUMBERED_LINE.findall(prompt)]
+        reply = {}
+        for key, text in entries:
+            if self.random.random() < self.pack_miss_prob:
+                self.stats['pack_misses'] += 1
+                continue
+            reply[key] = text
+        return json.dumps(reply, ensure_ascii=False)
+
+    async def complete(self, body: Dict[str, Any]) -> Tuple[int, Dict[str, str], Dict[str, Any]]:
+        self.stats['requests'] += 1
+        now = int(time.time())
+        if now != self.window_start:
+            self.window_start, self.window_count = now, 0
+        self.window_count += 1
+        headers = self._rate_limit_headers((self.rate_limit_rps or 1000000) - self.window_count)
+
+        if (self.rate_limit_rps and self.window_count > self.rate_limit_rps) or self.random.random() < self.rate_limit_prob:
+            return self._rate_limited(headers)
+
+        self.stats['in_flight'] += 1
+        self.stats['peak_in_flight'] = max(self.stats['peak_in_flight'], self.stats['in_flight'])
+        try:
+            await asyncio.sleep(self.latency())
+        finally:
+            self.stats['in_flight'] -= 1
+
+        if self.random.random() < self.error_prob:
+            self.stats['errors'] += 1
+            return 200, headers, {'error': {'message': 'Internal upstream error', 'code': 502}}
+
+        prompt = body['messages'][-1]['content']
+        n = min(body.get('n', 1), self.max_n) if self.max_n else 1
+        choices = []
+        for i in range(n):
+            if self.random.random() < self.refusal_prob:
+                self.stats['refusals'] += 1
+                message = {'role': 'assistant', 'content': None, 'refusal': 'I cannot help with that.'}
+            elif body.get('response_format', {}).get('type') == 'json_object':
+                message = {'role': 'assistant', 'content': self._json_reply(prompt)}
+            else:
+                message = {'role': 'assistant', 'content': f"mock translation {self.random.randint(0, 9)} of {prompt[-60:]!r}"}
+            choices.append({'index': i, 'message': message, 'finish_reason': 'stop'})
+        self.stats['completions'] += n
+        prompt_tokens = sum(len(m['content'].split()) for m in body['messages'])
+        return 200, headers, {
+            'id': f"mock-{self.stats['requests']}",
+            'object': 'chat.completion',
+            'created': now,
+            'model': body.get('model', 'mock'),
+            'choices': choices,
+            'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': 12 * n, 'total_tokens': prompt_tokens + 12 * n},
+        }
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode('latin-1').split(' ', 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    key, _, value = line.decode('latin-1').partition(':')
+                    headers[key.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+
+                if method == 'POST' and path.rstrip('/').endswith('/chat/completions'):
+                    status, response_headers, payload = await self.complete(json.loads(body))
+                elif method == 'GET' and path.rstrip('/').endswith('/stats'):
+                    status, response_headers, payload = 200, {}, self.stats
+                else:
+                    status, response_headers, payload = 404, {}, {'error': {'message': f"No route for {method} {path}", 'code': 404}}
+
+                data = json.dumps(payload).encode('utf-8')
+                head = [f"HTTP/1.1 {status} {REASONS.get(status, '')}", "Content-Type: application/json", f"Content-Length: {len(data)}"]
+                head += [f"{key}: {value}" for key, value in response_headers.items()]
+                writer.write(("\r\n".join(head) + "\r\n\r\n").encode('latin-1') + data)
+                await writer.drain()
+                if headers.get('connection', '').lower() == 'close':
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host: str = "127.0.0.1", port: int = 8765) -> None:
+        server = await asyncio.start_server(self.handle, host, port, backlog=4096)
+        print(f"Mock OpenRouter listening on http://{host}:{port}/api/v1", flush=True)
+        async with server:
+            await server.serve_forever()
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--latency", default="lognormal:-2.5,0.5", help="Latency distribution, e.g. constant:0.05 or lognormal:-2.5,0.5")
+    parser.add_argument("--rate_limit_rps", type=int, default=0, help="Requests per second before 429s (0 for no limit)")
+    parser.add_argument("--rate_limit_prob", type=float, default=0.0, help="Probability of injecting a 429 into any request")
+    parser.add_argument("--rate_limit_style", choices=["status", "body", "mixed"], default="mixed", help="HTTP 429 or OpenRouter-style error body")
+    parser.add_argument("--error_prob", type=float, default=0.0, help="Probability of an error payload")
+    parser.add_argument("--refusal_prob", type=float, default=0.0, help="Probability of a refusal per choice")
+    parser.add_argument("--max_n", type=int, default=128, help="Cap on choices per request (0 to ignore n)")
+    parser.add_argument("--pack_miss_prob", type=float, default=0.0, help="Probability of leaving a line or language out of a JSON-mode reply")
+    parser.add_argument("--seed", type=int, default=0)
+
+def from_args(args: argparse.Namespace) -> MockOpenRouter:
+    return MockOpenRouter(
+        latency=args.latency,
+        rate_limit_rps=args.rate_limit_rps,
+        rate_limit_prob=args.rate_limit_prob,
+        rate_limit_style=args.rate_limit_style,
+        error_prob=args.error_prob,
+        refusal_prob=args.refusal_prob,
+        max_n=args.max_n,
+        pack_miss_prob=args.pack_miss_prob,
+        seed=args.seed,
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock OpenRouter server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    add_arguments(parser)
+    args = parser.parse_args()
+    try:
+        asyncio.run(from_args(args).serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
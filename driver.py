@@ -1,11 +1,71 @@
 import subprocess
 import os
 import json
+import asyncio
+import fnmatch
 import argparse
-from utils.utils import generate_reference_files 
+from typing import Optional
+from utils.journal import journal_path
+from utils.telemetry import Telemetry, new_run_id, model_prices, write_summary
 from utils.config import Config
+from utils.scheduler import provider_of
+
+def get_target_languages(config: Config, target_languages):
+    if target_languages == "minimal":
+        return config.experiments['language_groups']['minimal']
+    elif target_languages == "full":
+        return config.experiments['language_groups']['full']
+    return target_languages
+
+def get_output_file(output_folder, model, source_language, target_language):
+    return os.path.join(output_folder, f"{model}_{source_language}_to_{target_language}.txt")
+
+def write_reference_files(config: Config, experiment_id, output_file, results_db=None, expand_references=False):
+    from utils.utils import generate_reference_files
+
+    # Check if output_file exists before proceeding
+    if os.path.exists(output_file):
+        ref_output_path = output_file.replace('.txt', '.references')
+        no_header_output_path = output_file.replace('.txt', '.candidates')
+        generate_reference_files(config, experiment_id, output_file, ref_output_path=ref_output_path, no_header_output_path=no_header_output_path, results_db=results_db, expand_references=expand_references)
+    else:
+        print(f"Warning: Output file {output_file} does not exist. Skipping reference file generation.")
+
+def select_experiments(config: Config, selectors):
+    """
+    Ids of the experiments matching every selector, in experiments.yaml order.
+
+    A selector is either a glob over experiment ids (`*_english_to_minimal`) or `key=glob`
+    over a field of the experiment (`model=gemini*`, `strategy=pass@1-*`); `provider=google`
+    matches on the api_name prefix of the experiment's model.
+    """
+    def matches(experiment_id, experiment_config, selector):
+        key, sep, pattern = selector.partition('=')
+        if not sep:
+            return fnmatch.fnmatchcase(experiment_id, selector)
+        if key == 'provider':
+            value = provider_of(config.get_model_config(experiment_config['model'])['api_name'])
+        else:
+            value = experiment_config.get(key)
+        return value is not None and fnmatch.fnmatchcase(str(value), pattern)
+
+    return [
+        experiment_id for experiment_id, experiment_config in config.get_all_experiments().items()
+        if all(matches(experiment_id, experiment_config, selector) for selector in selectors)
+    ]
+
+def languages_per_request(config: Config, experiment_id):
+    """Target languages asked for in one request by the experiment's strategy (1 unless multi-target)"""
+    strategy = config.get_strategy_config(config.get_experiment_config(experiment_id)['strategy'])
+    return strategy.get('languages_per_request', 1)
+
+def is_complete(output_file):
+    """An output file without a journal beside it was fully written"""
+    return os.path.exists(output_file) and not os.path.exists(journal_path(output_file))
+
+def run_experiment(config: Config, experiment_id, extra_args=(), resume=False, expand_references=False):
+    from utils.results_db import ResultsDB, results_path
 
-def run_experiment(config: Config, experiment_id):
     experiment_config = config.get_experiment_config(experiment_id)
     SOURCE_LANGUAGE = experiment_config['source_language']
     TEMPERATURE = experiment_config['temperature']
@@ -20,10 +80,13 @@ def run_experiment(config: Config, experiment_id):
     output_folder = f"experiments/{experiment_id}"
     os.makedirs(output_folder, exist_ok=True)
 
-    if TARGET_LANGUAGES == "minimal":
-        TARGET_LANGUAGES = config.experiments['language_groups']['minimal']
-    elif TARGET_LANGUAGES == "full":
-        TARGET_LANGUAGES = config.experiments['language_groups']['full']
+    TARGET_LANGUAGES = get_target_languages(config, TARGET_LANGUAGES)
+
+    telemetry_path = os.path.join(output_folder, "telemetry.jsonl")
+    run_id = new_run_id()
+    # Carries the retry budget and circuit breaker from one language's generate.py to the next
+    retry_state = os.path.join(output_folder, f"retry_state_{run_id}.json")
+    results_db = ResultsDB(results_path(output_folder))
 
     for target_language in TARGET_LANGUAGES:
 
@@ -32,44 +95,174 @@ def run_experiment(config: Config, experiment_id):
         print(f"Target Language: {target_language}")
         print(f"Temperature: {TEMPERATURE}")
         print(f"Strategy: {STRATEGY}")
-            
-        output_file = os.path.join(output_folder, f"{MODEL}_{SOURCE_LANGUAGE}_to_{target_language}.txt")
+
+        output_file = get_output_file(output_folder, MODEL, SOURCE_LANGUAGE, target_language)
         print(output_file)
-            
+
+        if resume and is_complete(output_file):
+            print(f"Skipping {target_language}: {output_file} is already complete")
+            continue
+
         command = [
             "python3", "generate.py",
             experiment_id,
             output_file,
-            target_language
+            target_language,
+            "--telemetry", telemetry_path,
+            "--run_id", run_id,
+            "--retry_state", retry_state,
+            *extra_args
         ]
-            
-        subprocess.run(command)
 
-        ref_output_path = output_file.replace('.txt', '.references')
-        no_header_output_path = output_file.replace('.txt', '.candidates')
-        # Check if output_file exists before proceeding
-        if os.path.exists(output_file):
-            ref_output_path = output_file.replace('.txt', '.references')
-            no_header_output_path = output_file.replace('.txt', '.candidates')
-            generate_reference_files(config, experiment_id, output_file, ref_output_path=ref_output_path, no_header_output_path=no_header_output_path)
+        returncode = subprocess.run(command).returncode
+        if returncode != 0 or not is_complete(output_file):
+            # A failed run leaves a partial output file and its journal; rerun with --resume
+            reason = f"generate.py exited with code {returncode}" if returncode != 0 else f"{output_file} is incomplete"
+            print(f"Error generating {target_language}: {reason}; skipping reference files")
+            continue
+
+        write_reference_files(config, experiment_id, output_file, results_db, expand_references)
+
+    results_db.close()
+    if os.path.exists(retry_state):
+        os.remove(retry_state)
+
+    if os.path.exists(telemetry_path):
+        write_summary(telemetry_path, run_id, model_prices(config.models))
+
+async def run_experiment_in_process(config: Config, experiment_id, max_concurrency: Optional[int] = None, cache=None, resume=False, expand_references=False):
+    """
+    Run every target language on one event loop, sharing one LLM client and its provider's concurrency limit.
+
+    With a multi-target strategy (`languages_per_request` > 1), the languages still to run are
+    generated in groups of that many, each group asking for all its languages in one request.
+    """
+    from generate import generate_language, generate_languages, create_llm
+    from utils.results_db import ResultsDB, results_path
+
+    experiment_config = config.get_experiment_config(experiment_id)
+    SOURCE_LANGUAGE = experiment_config['source_language']
+    MODEL = experiment_config['model']
+    TARGET_LANGUAGES = get_target_languages(config, experiment_config['target_languages'])
+
+    output_folder = f"experiments/{experiment_id}"
+    os.makedirs(output_folder, exist_ok=True)
+
+    llm = create_llm(config, MODEL, max_in_flight=max_concurrency)
+    telemetry = Telemetry(os.path.join(output_folder, "telemetry.jsonl"))
+    results_db = ResultsDB(results_path(output_folder))
+
+    print(f"Running {len(TARGET_LANGUAGES)} languages in process with LLM type: {MODEL}")
+    print(f"Max concurrent requests: {llm.limiter.max_limit}")
+
+    async def run_language(target_language):
+        output_file = get_output_file(output_folder, MODEL, SOURCE_LANGUAGE, target_language)
+        if resume and is_complete(output_file):
+            print(f"Skipping {target_language}: {output_file} is already complete")
+            return
+        try:
+            await generate_language(config, experiment_id, output_file, target_language, llm=llm, cache=cache, resume=resume, telemetry=telemetry, results_db=results_db)
+        except Exception as e:
+            # Keep the other languages running, as a failed subprocess would
+            print(f"Error generating {target_language}: {str(e)}")
+            return
+        write_reference_files(config, experiment_id, output_file, results_db, expand_references)
+
+    async def run_languages(target_languages):
+        output_files = {target_language: get_output_file(output_folder, MODEL, SOURCE_LANGUAGE, target_language) for target_language in target_languages}
+        try:
+            failed = await generate_languages(config, experiment_id, output_files, llm=llm, cache=cache, resume=resume, telemetry=telemetry, results_db=results_db)
+        except Exception as e:
+            print(f"Error generating {', '.join(target_languages)}: {str(e)}")
+            return
+        for target_language, output_file in output_files.items():
+            if target_language in failed:
+                print(f"Error generating {target_language}: {str(failed[target_language])}")
+            else:
+                write_reference_files(config, experiment_id, output_file, results_db, expand_references)
+
+    group_size = languages_per_request(config, experiment_id)
+    try:
+        if group_size > 1:
+            remaining = []
+            for target_language in TARGET_LANGUAGES:
+                output_file = get_output_file(output_folder, MODEL, SOURCE_LANGUAGE, target_language)
+                if resume and is_complete(output_file):
+                    print(f"Skipping {target_language}: {output_file} is already complete")
+                else:
+                    remaining.append(target_language)
+            groups = [remaining[k:k + group_size] for k in range(0, len(remaining), group_size)]
+            await asyncio.gather(*(run_languages(group) for group in groups))
         else:
-            print(f"Warning: Output file {output_file} does not exist. Skipping reference file generation.")
+            await asyncio.gather(*(run_language(target_language) for target_language in TARGET_LANGUAGES))
+    finally:
+        telemetry.close()
+        results_db.close()
+        write_summary(telemetry.path, telemetry.run_id, model_prices(config.models))
+
+async def run_experiments_in_process(config: Config, experiment_ids, max_concurrency: Optional[int] = None, cache=None, resume=False, expand_references=False):
+    """
+    Run several experiments concurrently on one event loop.
+
+    Experiments whose models share a provider share that provider's limiter, while
+    different providers are limited independently.
+    """
+    from models import close_http_client
+
+    if len(experiment_ids) > 1:
+        print(f"Running {len(experiment_ids)} experiments: {', '.join(experiment_ids)}")
+    try:
+        results = await asyncio.gather(
+            *(run_experiment_in_process(config, experiment_id, max_concurrency, cache=cache, resume=resume, expand_references=expand_references)
+              for experiment_id in experiment_ids),
+            return_exceptions=True
+        )
+    finally:
+        await close_http_client()
+    for experiment_id, result in zip(experiment_ids, results):
+        if isinstance(result, Exception):
+            print(f"Error running {experiment_id}: {str(result)}")
 
 def main():
     parser = argparse.ArgumentParser(description="Run translation experiments.")
-    parser.add_argument("--experiment_id", help="experiment id")
-    parser.add_argument("--list", action="store_true", help="List available experiments")
+    parser.add_argument("--experiment_id", nargs="+", help="One or more experiment ids")
+    parser.add_argument("--select", nargs="+", help="Select experiments by id glob or key=glob (e.g. model=gemini*, provider=google)")
+    parser.add_argument("--list", action="store_true", help="List available experiments (matching --select if given)")
+    parser.add_argument("--in_process", action="store_true", help="Run all target languages in one process and event loop (implied by several experiments)")
+    parser.add_argument("--max_concurrency", type=int, default=None, help="Limit on in-flight requests per provider for --in_process")
+    parser.add_argument("--no_cache", action="store_true", help="Do not read or write the completion cache")
+    parser.add_argument("--cache_read_only", action="store_true", help="Read the completion cache without writing to it")
+    parser.add_argument("--resume", action="store_true", help="Skip completed languages and resume interrupted ones from their journals")
+    parser.add_argument("--expand_references", action="store_true", help="Also write .references files with each reference repeated once per candidate")
     args = parser.parse_args()
 
     config = Config()
     if args.list:
         experiments = config.get_all_experiments()
-        for experiment_id, experiment_config in experiments.items():
-            print(f"{experiment_id}: {experiment_config}")
+        for experiment_id in select_experiments(config, args.select or []):
+            print(f"{experiment_id}: {experiments[experiment_id]}")
         return
     try:
-        run_experiment(config, args.experiment_id)
-        pass
+        experiment_ids = list(args.experiment_id or [])
+        if args.select:
+            experiment_ids += [experiment_id for experiment_id in select_experiments(config, args.select) if experiment_id not in experiment_ids]
+        if not experiment_ids:
+            raise ValueError("No experiments given or selected")
+        unknown = [experiment_id for experiment_id in experiment_ids if experiment_id not in config.get_all_experiments()]
+        if unknown:
+            raise ValueError(f"Unknown experiment(s): {', '.join(unknown)}")
+
+        multi_target = [experiment_id for experiment_id in experiment_ids if languages_per_request(config, experiment_id) > 1]
+        if multi_target and not args.in_process and len(experiment_ids) == 1:
+            print(f"{experiment_ids[0]} asks for several languages per request, so its languages run in process")
+        if args.in_process or len(experiment_ids) > 1 or multi_target:
+            from utils.cache import open_cache
+            cache = None if args.no_cache else open_cache(config.base.get('cache'), read_only=args.cache_read_only or None)
+            asyncio.run(run_experiments_in_process(config, experiment_ids, args.max_concurrency, cache=cache, resume=args.resume, expand_references=args.expand_references))
+        else:
+            flags = (("--no_cache", args.no_cache), ("--cache_read_only", args.cache_read_only), ("--resume", args.resume))
+            extra_args = [flag for flag, enabled in flags if enabled]
+            run_experiment(config, experiment_ids[0], extra_args, resume=args.resume, expand_references=args.expand_references)
     except ValueError as e:
         print(f"Error: {e}")
         print("Use --list to see available experiments.")
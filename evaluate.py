@@ -0,0 +1,197 @@
+import os
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Optional, Tuple
+
+import numpy as np
+import dotenv
+
+from utils.config import Config
+from utils.metrics import METRICS, score_language
+from utils.scores import counts_path, save_group_counts, save_scores
+from utils.results_db import ResultsDB, results_path
+from utils.references import candidate_references, read_references
+
+dotenv.load_dotenv()
+
+def find_language_files(experiment_dir: str) -> List[Tuple[str, str, str]]:
+    """
+    (language, candidates file, references file) for every language driver.py wrote in `experiment_dir`.
+
+    The references file is the `.refs` file of unique references where there is one,
+    else a legacy `.references` file with one reference per candidate.
+    """
+    pairs = []
+    for filename in sorted(os.listdir(experiment_dir)):
+        if not filename.endswith('.candidates'):
+            continue
+        stem = os.path.splitext(filename)[0]
+        references = os.path.join(experiment_dir, f"{stem}.refs")
+        if not os.path.exists(references):
+            references = os.path.join(experiment_dir, f"{stem}.references")
+        if not os.path.exists(references):
+            print(f"Warning: no references for {filename}, skipping")
+            continue
+        pairs.append((stem.split('_to_')[-1], os.path.join(experiment_dir, filename), references))
+    return pairs
+
+def read_segments(path: str) -> List[str]:
+    with open(path, 'r', encoding='utf-8') as f:
+        return [line.rstrip('\n') for line in f]
+
+def read_candidate_references(path: str) -> Tuple[List[str], Optional[np.ndarray]]:
+    """
+    The reference of every candidate and the number of candidates of each source line,
+    from a `.refs` file and its counts or a legacy `.references` file (counts None)
+    """
+    if path.endswith('.refs'):
+        references, counts = read_references(path, f"{os.path.splitext(path)[0]}.ref_counts.npy")
+        return candidate_references(references, counts), counts
+    return read_segments(path), None
+
+def key_counts(keys: List[Tuple[int, int]]) -> np.ndarray:
+    """Number of samples of each source line, from (source_id, pass_idx) keys sorted by source"""
+    return np.unique(np.array([source_id for source_id, _ in keys]), return_counts=True)[1]
+
+# language, (source_id, pass_idx) keys from the results dataset (None for text files), candidates, references,
+# candidates per source line (None if unknown)
+Job = Tuple[str, Optional[List[Tuple[int, int]]], List[str], List[str], Optional[np.ndarray]]
+
+def load_jobs(experiment_dir: str, results_db: Optional[ResultsDB] = None) -> List[Job]:
+    """
+    Segments of every language of an experiment.
+
+    Languages in `results_db` are read from it, candidates joined to references by source id;
+    the .candidates/.references files are only read for languages it does not hold.
+    """
+    jobs = []
+    stored = set()
+    if results_db is not None:
+        for language in results_db.languages():
+            keys, candidates, references = results_db.pairs(language)
+            if keys:
+                jobs.append((language, keys, candidates, references, key_counts(keys)))
+                stored.add(language)
+    for language, candidates_file, references_file in find_language_files(experiment_dir):
+        if language not in stored:
+            references, counts = read_candidate_references(references_file)
+            jobs.append((language, None, read_segments(candidates_file), references, counts))
+    return sorted(jobs, key=lambda job: job[0])
+
+def evaluate_language(language: str, candidates: List[str], references: List[str], metrics: List[str]) -> Tuple[str, Dict[str, np.ndarray]]:
+    """Worker: score one language's candidates against its references"""
+    return language, score_language(language, candidates, references, metrics)
+
+def write_scores(path: str, scores: np.ndarray) -> None:
+    """One score per line, the format generate_coverage_graph.py reads, plus its binary .npy store"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write("".join(f"{score}\n" for score in scores.tolist()))
+    save_scores(path, scores)
+
+def open_bleurt(config: Config):
+    """BleurtScorer for the `bleurt` section of base.yaml, with its persistent score cache"""
+    from utils.bleurt import BleurtScorer
+    from utils.cache import ScoreCache
+
+    bleurt_config = config.base.get('bleurt', {})
+    checkpoint = bleurt_config.get('checkpoint')
+    if not checkpoint or not os.path.isdir(checkpoint):
+        raise ValueError(f"BLEURT checkpoint {checkpoint} not found; set bleurt.checkpoint in base.yaml")
+    cache = ScoreCache(bleurt_config['cache_path']) if bleurt_config.get('cache_path') else None
+    return BleurtScorer(checkpoint, batch_size=bleurt_config.get('batch_size', 64), threads=bleurt_config.get('threads'), cache=cache)
+
+def score_bleurt(scorer, jobs: List[Job]) -> Dict[str, np.ndarray]:
+    """BLEURT scores per language, batching the distinct pairs of all languages together"""
+    segments = {language: (candidates, references) for language, _, candidates, references, _ in jobs}
+    for language, (candidates, references) in list(segments.items()):
+        if len(candidates) != len(references):
+            print(f"Error: {language}: {len(candidates)} candidates but {len(references)} references")
+            del segments[language]
+    pairs = list(dict.fromkeys(pair for candidates, references in segments.values() for pair in zip(candidates, references)))
+    scores = scorer.score_pairs(pairs)
+    return {
+        language: np.array([scores[pair] for pair in zip(candidates, references)], dtype=np.float64)
+        for language, (candidates, references) in segments.items()
+    }
+
+def evaluate_experiment(config: Config, experiment_id: str, metrics: List[str], primary: str, workers: int, languages=None, bleurt=None) -> Dict[str, Dict[str, float]]:
+    """
+    Score every language of an experiment.
+
+    Lexical metrics run one language per worker process. BLEURT runs in this process on
+    `bleurt`, a BleurtScorer that uses all cores itself.
+    Scores of the `primary` metric are written to evals/<experiment_id>/<Language>_scores.eval,
+    where generate_coverage_graph.py reads them; other metrics go to evals/<experiment_id>/<metric>/.
+    Scores of languages read from the experiment's results dataset are also stored in it.
+    Returns the mean score per language and metric.
+    """
+    experiment_dir = f"experiments/{experiment_id}"
+    if not os.path.isdir(experiment_dir):
+        raise ValueError(f"Experiment {experiment_id} has no outputs in {experiment_dir}")
+    eval_dir = os.path.join(config.base['paths']['base_path'], 'evals', experiment_id)
+    results_db = ResultsDB(results_path(experiment_dir)) if os.path.exists(results_path(experiment_dir)) else None
+
+    jobs = [job for job in load_jobs(experiment_dir, results_db) if languages is None or job[0] in languages]
+    print(f"Scoring {len(jobs)} languages of {experiment_id} with {', '.join(metrics)}")
+    means = {language: {} for language, _, _, _, _ in jobs}
+    keys = {language: language_keys for language, language_keys, _, _, _ in jobs}
+    group_counts = {language: counts for language, _, _, _, counts in jobs}
+
+    def write(language: str, metric: str, values: np.ndarray) -> None:
+        directory = eval_dir if metric == primary else os.path.join(eval_dir, metric)
+        path = os.path.join(directory, f"{language}_scores.eval")
+        write_scores(path, values)
+        counts = group_counts[language]
+        # Groups of unequal size (adaptive sampling) are recorded for generate_coverage_graph.py
+        if counts is not None and len(counts) and counts.min() != counts.max():
+            save_group_counts(path, counts)
+        elif os.path.exists(counts_path(path)):
+            os.remove(counts_path(path))
+        if keys[language] is not None:
+            results_db.add_scores(language, metric, keys[language], values)
+        means[language][metric] = float(np.mean(values)) if len(values) else 0.0
+
+    lexical = [metric for metric in metrics if metric in METRICS]
+    if lexical:
+        with ProcessPoolExecutor(max_workers=min(workers, max(len(jobs), 1))) as pool:
+            futures = [pool.submit(evaluate_language, language, candidates, references, lexical)
+                       for language, _, candidates, references, _ in jobs]
+            for future in futures:
+                try:
+                    language, scores = future.result()
+                except ValueError as e:
+                    print(f"Error: {e}")
+                    continue
+                for metric, values in scores.items():
+                    write(language, metric, values)
+    if 'bleurt' in metrics:
+        for language, values in score_bleurt(bleurt, jobs).items():
+            write(language, 'bleurt', values)
+
+    if results_db is not None:
+        results_db.close()
+    for language, language_means in means.items():
+        print(f"  {language}: " + ", ".join(f"{metric} {mean:.4g}" for metric, mean in language_means.items()))
+    print(f"Scores written to {eval_dir}")
+    return means
+
+def main():
+    parser = argparse.ArgumentParser(description="Score experiment outputs with chrF++, BLEU, TER and BLEURT on the CPU")
+    parser.add_argument("--experiment_id", nargs="+", required=True, help="One or more experiment ids")
+    parser.add_argument("--metrics", nargs="+", choices=list(METRICS) + ['bleurt'], default=list(METRICS), help="Metrics to compute")
+    parser.add_argument("--primary", choices=['chrf', 'bleu', 'bleurt'], default=None,
+                        help="Metric written to evals/<experiment_id>/ for generate_coverage_graph.py (default: bleurt if computed, else chrf)")
+    parser.add_argument("--languages", nargs="+", help="Only score these target languages")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Worker processes (one language each)")
+    args = parser.parse_args()
+
+    primary = args.primary or ('bleurt' if 'bleurt' in args.metrics else 'chrf')
+    metrics = args.metrics if primary in args.metrics else [primary] + args.metrics
+    config = Config()
+    bleurt = open_bleurt(config) if 'bleurt' in metrics else None
+    for experiment_id in args.experiment_id:
+        evaluate_experiment(config, experiment_id, metrics, primary, args.workers, args.languages, bleurt)
+
+if __name__ == "__main__":
+    main()
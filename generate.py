@@ -1,42 +1,435 @@
+import os
+import time
 import argparse
 import asyncio
 import json
 import textwrap
-from typing import List, Dict, Any
+from contextlib import aclosing
+from typing import List, Dict, Any, Optional, Tuple, AsyncIterator, Callable
 from utils.utils import read_lines
 from utils.config import Config
-from models import LLM, LLMRateLimitError, LLMError
+from utils.scheduler import get_limiter, provider_of, limiter_settings
+from utils.cache import CompletionCache, completion_key, open_cache
+from utils.journal import CallJournal, journal_path
+from utils.writer import OrderedWriter
+from utils.telemetry import CallStats, Telemetry, model_prices, write_summary
+from utils.retry import RetryPolicy, RetryBudget, CircuitBreaker, load_retry_state, save_retry_state
+from utils.results_db import ResultsDB, results_path
+from utils.references import sample_counts_path
+from utils.packing import (DEFAULT_MULTI_TARGET_TEMPLATE, DEFAULT_PACK_TEMPLATE, multi_target_prompt, pack_prompt,
+                           parse_multi_target_reply, parse_packed_reply)
+from models import LLM, LLMCallsFailed, close_http_client
 
-async def executeCalls(calls: List[Dict[str, Any]]) -> List[str]:
-    """Execute a batch of LLM calls with retries"""
-    async def make_call(llm: LLM, prompt: str, system_prompt: str, temperature: float) -> str:
-        for _ in range(3):  # 3 retries
+def create_llm(config: Config, model_id: str, limiter_name: Optional[str] = None, max_in_flight: Optional[int] = None) -> LLM:
+    """
+    Create an LLM whose in-flight requests are bounded by the shared limiter of its provider
+    (the prefix of its api_name), so that models of one provider share a concurrency pool and
+    a throttled provider does not hold back the others. `max_in_flight` overrides the configured
+    ceiling of that limiter when it is created.
+    Its requests go through the process-wide connection pool configured by `http` in base.yaml.
+
+    The LLM gets its own retry budget and circuit breaker, so they span every call made through it;
+    generate.py workers hand theirs on to the next language's worker with `--retry_state`.
+    """
+    model_config = config.get_model_config(model_id)
+    api_name = model_config['api_name']
+    provider = provider_of(api_name)
+    limiter = get_limiter(limiter_name or provider, **limiter_settings(config.base['concurrency'], provider, max_in_flight))
+    retry = config.base.get('retry', {})
+    return LLM(
+        api_name,
+        limiter=limiter,
+        max_samples_per_request=model_config.get('max_samples_per_request', 128),
+        base_url=os.getenv("OPENROUTER_BASE_URL", config.base['api']['base_url']),
+        retry_policy=RetryPolicy(
+            max_attempts=retry.get('max_attempts', 6),
+            base_delay=retry.get('base_delay', 1.0),
+            max_delay=retry.get('max_delay', 60.0),
+            deadline=retry.get('deadline', 900.0),
+        ),
+        retry_budget=RetryBudget(retry.get('budget_ratio', 0.2), retry.get('budget_minimum', 50)),
+        breaker=CircuitBreaker(retry.get('breaker_failures', 10), retry.get('breaker_reset', 60.0)),
+        http_settings=config.base.get('http'),
+    )
+
+def group_calls(calls: List[Dict[str, Any]], samples_per_request: int = 1) -> List[List[int]]:
+    """Group runs of identical consecutive calls into batches of at most `samples_per_request` indices"""
+    batches = []
+    previous_key = None
+    for i, call in enumerate(calls):
+        key = (call['model'], call['prompt'], call['system_prompt'], call['temperature'])
+        if batches and key == previous_key and len(batches[-1]) < samples_per_request:
+            batches[-1].append(i)
+        else:
+            batches.append([i])
+        previous_key = key
+    return batches
+
+def add_samples(
+    results_db: Optional[ResultsDB],
+    calls: List[Dict[str, Any]],
+    indices: List[int],
+    texts: List[str],
+    stats: Optional[CallStats] = None,
+) -> None:
+    """Add the samples of `calls[indices]` to `results_db` with their request's latency and an even
+    share of its tokens (no latency or tokens without `stats`, for cache and journal hits)"""
+    if results_db is None or not indices:
+        return
+    latency = stats.latency if stats is not None else None
+    prompt_tokens = stats.prompt_tokens / len(indices) if stats is not None else 0.0
+    completion_tokens = stats.completion_tokens / len(indices) if stats is not None else 0.0
+    results_db.add_candidates(
+        (calls[i]['language'], calls[i]['source_index'], calls[i]['pass_index'], text, latency, prompt_tokens, completion_tokens)
+        for i, text in zip(indices, texts)
+    )
+
+def call_key(call: Dict[str, Any]) -> str:
+    """Cache key of a call's completion: its model, prompts, temperature and pass"""
+    return completion_key(call['model'], call['system_prompt'], call['prompt'], call['temperature'], call.get('pass_index', 0))
+
+def template_key(call: Dict[str, Any], template: str) -> str:
+    """Cache key of a call answered by a request built from `template` (a pack or multi-target prompt).
+
+    The key has the call's source and language in place of its own prompt, so these results
+    are never served to runs asking for the line on its own.
+    """
+    return completion_key(call['model'], call['system_prompt'], f"{template}\0{call['language']}\0{call['source']}",
+                          call['temperature'], call.get('pass_index', 0))
+
+def replay_hits(
+    calls: List[Dict[str, Any]],
+    indices: List[int],
+    key: Callable[[Dict[str, Any]], str],
+    cache: Optional[CompletionCache] = None,
+    journal: Optional[CallJournal] = None,
+    telemetry: Optional[Telemetry] = None,
+    results_db: Optional[ResultsDB] = None,
+) -> Tuple[Dict[int, str], int]:
+    """Results of `calls[indices]` already in `journal` or else in `cache` under `key`, by call index,
+    and how many of them came from the cache. The journal and cache hits are each recorded in
+    `telemetry`, and every hit is added to `results_db`."""
+    start = time.time()
+    passes = lambda hit_indices: [calls[i]['pass_index'] for i in hit_indices]
+    results = {}
+    if journal is not None:
+        for i in indices:
+            text = journal.get(calls[i]['source_index'], calls[i]['pass_index'])
+            if text is not None:
+                results[i] = text
+        if results and telemetry is not None:
+            telemetry.record(calls[indices[0]], passes(results), start, source='journal')
+    pending = [i for i in indices if i not in results]
+    cache_hits = 0
+    if cache is not None and pending:
+        keys = {i: key(calls[i]) for i in pending}
+        hits = cache.get_many(keys.values())
+        hit_indices = [i for i in pending if keys[i] in hits]
+        for i in hit_indices:
+            results[i] = hits[keys[i]]
+        if hit_indices and telemetry is not None:
+            telemetry.record(calls[indices[0]], passes(hit_indices), start, source='cache')
+        cache_hits = len(hit_indices)
+    add_samples(results_db, calls, sorted(results), [results[i] for i in sorted(results)])
+    return results, cache_hits
+
+async def iterCalls(
+    calls: List[Dict[str, Any]],
+    llm: Optional[LLM] = None,
+    samples_per_request: int = 1,
+    cache: Optional[CompletionCache] = None,
+    journal: Optional[CallJournal] = None,
+    window: Optional[int] = None,
+    telemetry: Optional[Telemetry] = None,
+    results_db: Optional[ResultsDB] = None,
+) -> AsyncIterator[Tuple[int, str]]:
+    """Execute LLM calls with retries, yielding (call index, result) pairs as they complete.
+
+    A shared `llm` can be passed in so that several languages run on one client,
+    under the concurrency limit of its limiter. With `samples_per_request` > 1,
+    identical consecutive calls (the passes of one source line) are sent as one
+    request for several samples and fanned back out to their positions.
+    Calls already in `journal` or found in `cache` are answered without a request,
+    and every completed call is appended to `journal` as it lands.
+
+    At most `window` batches are started ahead of the earliest unfinished one, which
+    bounds how far results can run ahead of an in-order consumer.
+
+    If `telemetry` is given, each request and each cache or journal hit is recorded.
+    If `results_db` is given, every sample is added to it with its request's latency and its
+    share of the request's tokens (no latency or tokens for cache and journal hits).
+
+    Retries happen inside `llm` only. Once a call has failed for good no further batches
+    are started; the batches already running are finished and yielded, and then
+    LLMCallsFailed is raised listing every failed call.
+    """
+    # Create a single LLM instance for all calls
+    if llm is None:
+        llm = LLM(calls[0]['model'], limiter=get_limiter(provider_of(calls[0]['model'])))
+    if window is None:
+        window = 4 * (llm.limiter.max_limit if llm.limiter is not None else 64)
+
+    cache_hits = 0
+
+    async def run_batch(batch: List[int]) -> List[Tuple[int, str]]:
+        nonlocal cache_hits
+        start = time.time()
+        first = calls[batch[0]]
+        passes = lambda indices: [calls[i]['pass_index'] for i in indices]
+        results, hits = replay_hits(calls, batch, call_key, cache, journal, telemetry, results_db)
+        cache_hits += hits
+        pending = [i for i in batch if i not in results]
+
+        samples = []
+        if pending:
+            stats = CallStats()
             try:
-                return await llm(prompt, system_prompt, temperature)
-            except LLMRateLimitError as e:
-                print(e)
-                print(f"{llm.model_name} rate limited. Waiting {e.cooldown} seconds before retrying...")
-                await asyncio.sleep(e.cooldown)
-            except LLMError as e:
-                print(e)
-                print(f"Error calling {llm.model_name}: {str(e)}")
+                samples = await llm.sample(first['prompt'], first['system_prompt'], first['temperature'], n=len(pending), stats=stats)
+            except Exception as e:
+                if telemetry is not None:
+                    telemetry.record(first, passes(pending), start, stats, error=e)
                 raise
+            if telemetry is not None:
+                telemetry.record(first, passes(pending), start, stats)
+            for i, sample in zip(pending, samples):
+                results[i] = sample
+            add_samples(results_db, calls, pending, samples, stats)
+            if cache is not None:
+                cache.put_many([(call_key(calls[i]), sample) for i, sample in zip(pending, samples)])
 
-    # Create a single LLM instance for all calls
-    llm = LLM(calls[0]['model'])
-    
-    tasks = [
-        make_call(
-            llm,
-            call['prompt'],
-            call['system_prompt'],
-            call['temperature']
-        ) for call in calls
-    ]
-
-    results = await asyncio.gather(*tasks)
+        if journal is not None:
+            for i, sample in zip(pending, samples):
+                journal.record(calls[i]['source_index'], calls[i]['pass_index'], sample)
+        return sorted(results.items())
+
+    batches = group_calls(calls, samples_per_request)
+    running = {}
+    next_batch = 0
+    failures = []
+    try:
+        while running or (next_batch < len(batches) and not failures):
+            oldest = min(running.values(), default=next_batch)
+            while next_batch < len(batches) and next_batch - oldest < window and not failures:
+                running[asyncio.ensure_future(run_batch(batches[next_batch]))] = next_batch
+                next_batch += 1
+            done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                batch = batches[running.pop(task)]
+                if task.exception() is not None:
+                    failures.append((calls[batch[0]], len(batch), task.exception()))
+                    continue
+                for result in task.result():
+                    yield result
+        if failures:
+            failures.sort(key=lambda failure: (failure[0]['source_index'], failure[0]['pass_index']))
+            details = "\n".join(
+                f"  source {call['source_index']} passes {call['pass_index']}-{call['pass_index'] + count - 1}: {type(error).__name__}: {error}"
+                for call, count, error in failures
+            )
+            skipped = sum(len(batch) for batch in batches[next_batch:])
+            raise LLMCallsFailed(
+                f"{sum(count for _, count, _ in failures)} call(s) to {llm.model_name} failed, {skipped} not started:\n{details}",
+                [(call, error) for call, _, error in failures],
+            )
+    finally:
+        # Don't leave this language's calls running once it has failed or been abandoned
+        for task in running:
+            task.cancel()
+        if cache is not None and cache_hits:
+            print(f"Cache hits: {cache_hits}")
+
+async def executeCalls(
+    calls: List[Dict[str, Any]],
+    llm: Optional[LLM] = None,
+    samples_per_request: int = 1,
+    cache: Optional[CompletionCache] = None,
+    journal: Optional[CallJournal] = None,
+    telemetry: Optional[Telemetry] = None,
+) -> List[str]:
+    """Execute a batch of LLM calls with retries, returning results in call order"""
+    results = [None] * len(calls)
+    async for i, result in iterCalls(calls, llm, samples_per_request, cache, journal, telemetry=telemetry):
+        results[i] = result
     return results
 
+async def iterPackedCalls(
+    calls: List[Dict[str, Any]],
+    pack_size: int,
+    in_lang: str,
+    pack_template: str = DEFAULT_PACK_TEMPLATE,
+    llm: Optional[LLM] = None,
+    cache: Optional[CompletionCache] = None,
+    journal: Optional[CallJournal] = None,
+    window: Optional[int] = None,
+    telemetry: Optional[Telemetry] = None,
+    results_db: Optional[ResultsDB] = None,
+) -> AsyncIterator[Tuple[int, str]]:
+    """Execute calls `pack_size` source lines per request, yielding (call index, result) pairs as they complete.
+
+    The sources of up to `pack_size` calls of one pass are numbered in one prompt built from
+    `pack_template`, sent with the strategy's system prompt in JSON mode, and the reply is split
+    back into per-line results by utils.packing.parse_packed_reply. Lines the reply misses or
+    garbles, and the lines of a pack whose request fails, are re-queued as soon as the pack
+    returns and run on their own through iterCalls with their usual prompts; a pack is finished
+    once all its lines are. As in iterCalls, at most `window` packs are started ahead of the
+    earliest unfinished one, and once a re-queued line has failed for good no further packs
+    are started and LLMCallsFailed is raised after the running ones finish.
+
+    Journal hits are replayed as in iterCalls. Results are cached per line under their source,
+    language and pack template rather than their single-line prompt, so packed results are
+    never served to unpacked runs; re-queued lines are cached under both.
+    """
+    if llm is None:
+        llm = LLM(calls[0]['model'], limiter=get_limiter(provider_of(calls[0]['model'])))
+    if window is None:
+        window = 4 * (llm.limiter.max_limit if llm.limiter is not None else 64)
+
+    cache_key = lambda call: template_key(call, pack_template)
+    results, cache_hits = replay_hits(calls, list(range(len(calls))), cache_key, cache, journal, telemetry, results_db)
+    if cache is not None:
+        print(f"Cache hits: {cache_hits}")
+    pending = [i for i in range(len(calls)) if i not in results]
+    for i in sorted(results):
+        yield i, results[i]
+
+    # Packs hold calls of one pass, so one request never asks for two samples of a line
+    by_pass: Dict[int, List[int]] = {}
+    for i in pending:
+        by_pass.setdefault(calls[i]['pass_index'], []).append(i)
+    packs = [indices[k:k + pack_size] for indices in by_pass.values() for k in range(0, len(indices), pack_size)]
+
+    requeued = 0
+
+    async def run_pack(pack: List[int]) -> Tuple[Dict[int, str], List[Tuple[Dict[str, Any], BaseException]]]:
+        """Results of the pack's lines, with the re-queued ones that failed for good"""
+        nonlocal requeued
+        first = calls[pack[0]]
+        prompt = pack_prompt(pack_template, in_lang, first['language'], [calls[i]['source'] for i in pack])
+        stats = CallStats()
+        pack_start = time.time()
+        translations = {}
+        try:
+            reply = (await llm.sample(prompt, first['system_prompt'], first['temperature'], n=1, stats=stats,
+                                      response_format={'type': 'json_object'}))[0]
+        except Exception as e:
+            if telemetry is not None:
+                telemetry.record(first, [calls[i]['pass_index'] for i in pack], pack_start, stats, error=e)
+            print(f"Packed request for sources {first['source_index']}-{calls[pack[-1]]['source_index']} failed ({type(e).__name__}: {e}); re-queueing them on their own")
+        else:
+            translations = {pack[position]: text for position, text in parse_packed_reply(reply, len(pack)).items()}
+            if telemetry is not None:
+                telemetry.record(first, [calls[i]['pass_index'] for i in translations], pack_start, stats)
+            add_samples(results_db, calls, list(translations), list(translations.values()), stats)
+            if cache is not None:
+                cache.put_many([(cache_key(calls[i]), text) for i, text in translations.items()])
+            if journal is not None:
+                for i, text in translations.items():
+                    journal.record(calls[i]['source_index'], calls[i]['pass_index'], text)
+
+        missing = [i for i in pack if i not in translations]
+        requeued += len(missing)
+        if not missing:
+            return translations, []
+        try:
+            async with aclosing(iterCalls([calls[i] for i in missing], llm, 1, cache, journal, telemetry=telemetry, results_db=results_db)) as retries:
+                async for j, result in retries:
+                    if cache is not None:
+                        cache.put_many([(cache_key(calls[missing[j]]), result)])  # So a rerun finds the whole pack cached
+                    translations[missing[j]] = result
+        except LLMCallsFailed as e:
+            return translations, e.failures
+        return translations, []
+
+    running = {}
+    next_pack = 0
+    failures = []
+    try:
+        while running or (next_pack < len(packs) and not failures):
+            oldest = min(running.values(), default=next_pack)
+            while next_pack < len(packs) and next_pack - oldest < window and not failures:
+                running[asyncio.ensure_future(run_pack(packs[next_pack]))] = next_pack
+                next_pack += 1
+            done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                running.pop(task)
+                translations, pack_failures = task.result()
+                failures.extend(pack_failures)
+                for i, text in translations.items():
+                    yield i, text
+    finally:
+        for task in running:
+            task.cancel()
+    print(f"Packed {len(pending)} lines into {next_pack} requests; {requeued} re-queued on their own")
+    if failures:
+        failures.sort(key=lambda failure: (failure[0]['source_index'], failure[0]['pass_index']))
+        details = "\n".join(
+            f"  source {call['source_index']} pass {call['pass_index']}: {type(error).__name__}: {error}"
+            for call, error in failures
+        )
+        skipped = sum(len(pack) for pack in packs[next_pack:])
+        raise LLMCallsFailed(f"{len(failures)} call(s) to {llm.model_name} failed, {skipped} not started:\n{details}", failures)
+
+async def iterAdaptiveCalls(
+    calls: List[Dict[str, Any]],
+    passes: int,
+    settings: Dict[str, Any],
+    references: Optional[List[str]] = None,
+    llm: Optional[LLM] = None,
+    samples_per_request: int = 1,
+    cache: Optional[CompletionCache] = None,
+    journal: Optional[CallJournal] = None,
+    telemetry: Optional[Telemetry] = None,
+    results_db: Optional[ResultsDB] = None,
+) -> AsyncIterator[Tuple[int, List[str]]]:
+    """Sample each source line in waves until more samples stop paying off, yielding
+    (source index, samples) as each source line stops.
+
+    `calls` holds `passes` calls per source line, as generateCalls makes them; `settings`
+    come from utils.adaptive.adaptive_settings. Every wave runs through iterCalls, so the
+    cache, journal, telemetry and results dataset see the same calls as a full run, and a
+    resumed run replays the same stopping decisions. A wave asks each active source line
+    for `min_samples` (the first wave) or `wave_size` more samples; its samples are then
+    scored and a source stops once best_of_gain falls below `threshold` or it has `passes`
+    samples. Scoring runs in a thread so other languages on the event loop are not held up.
+    """
+    from utils.adaptive import SampleScorer, best_of_gain
+
+    num_sources = len(calls) // passes
+    scorers = [SampleScorer(settings['metric'], references[source] if references is not None else None) for source in range(num_sources)]
+    samples: List[List[str]] = [[] for _ in range(num_sources)]
+    active = list(range(num_sources))
+    wave = 0
+    while active:
+        wave_calls, owners = [], []
+        for source in active:
+            taken = len(samples[source])
+            size = min(settings['min_samples'] if taken == 0 else settings['wave_size'], passes - taken)
+            wave_calls.extend(calls[source * passes + taken:source * passes + taken + size])
+            owners.extend([source] * size)
+        results: List[Optional[str]] = [None] * len(wave_calls)
+        async with aclosing(iterCalls(wave_calls, llm, samples_per_request, cache, journal,
+                                      telemetry=telemetry, results_db=results_db)) as wave_results:
+            async for i, result in wave_results:
+                results[i] = result
+        new_samples: Dict[int, List[str]] = {}
+        for source, result in zip(owners, results):
+            new_samples.setdefault(source, []).append(result)
+
+        def score_wave() -> Dict[int, float]:
+            return {source: best_of_gain(scorers[source].add(texts), len(texts)) for source, texts in new_samples.items()}
+
+        gains = await asyncio.to_thread(score_wave)
+        wave += 1
+        still_active = []
+        for source in active:
+            samples[source].extend(new_samples[source])
+            if len(samples[source]) >= passes or (len(samples[source]) >= settings['min_samples'] and gains[source] < settings['threshold']):
+                yield source, samples[source]
+            else:
+                still_active.append(source)
+        print(f"Adaptive wave {wave}: {len(wave_calls)} samples, {len(still_active)} of {num_sources} sources still sampling")
+        active = still_active
+
 def generateCalls(config: Config, experiment_id: str, out_lang: str) -> List[Dict[str, Any]]:
     """Generate the list of LLM calls for the experiment"""
     experiment_config = config.get_experiment_config(experiment_id)
@@ -47,10 +440,10 @@ def generateCalls(config: Config, experiment_id: str, out_lang: str) -> List[Dic
     source_file = experiment_config['in_file']
 
     
-    sources = read_lines(source_file, experiment_config['num_lines'])
+    sources = read_lines(source_file, experiment_config['num_lines'], experiment_config['line_ids'], config.base['paths'].get('flores_index'))
     calls = []
 
-    for source in sources:
+    for source_index, source in enumerate(sources):
         system_prompt = strategy_config['system_prompt'].format(
             in_lang=in_lang,
             out_lang=out_lang
@@ -61,12 +454,16 @@ def generateCalls(config: Config, experiment_id: str, out_lang: str) -> List[Dic
             source=source
         )
         
-        for _ in range(strategy_config['passes']):
+        for pass_index in range(strategy_config['passes']):
             calls.append({
                 'model': model_config['api_name'],
                 'prompt': prompt,
                 'system_prompt': system_prompt,
-                'temperature': experiment_config.get('temperature', strategy_config['temperature'])
+                'temperature': experiment_config.get('temperature', strategy_config['temperature']),
+                'language': out_lang,
+                'source': source,
+                'source_index': source_index,
+                'pass_index': pass_index
             })
 
     print(f"Generating with model: {experiment_config['model']}")
@@ -78,42 +475,367 @@ def generateCalls(config: Config, experiment_id: str, out_lang: str) -> List[Dic
 
     return calls
 
-def process_results(results: List[str], args: argparse.Namespace, config: Config) -> None:
-    """Process and write results to output file"""
-    experiment_config = config.get_experiment_config(args.experiment_id)
-    
-    header = textwrap.dedent(f"""
+def read_target_references(config: Config, experiment_id: str, out_lang: str) -> List[str]:
+    """FLORES references of the experiment's source lines in `out_lang`"""
+    experiment_config = config.get_experiment_config(experiment_id)
+    language = config.languages.get(out_lang)
+    if language is None:
+        raise ValueError(f"No FLORES references for {out_lang}: it is not in languages.yaml")
+    return read_lines(f"{config.base['paths']['base_flores']}/devtest.{language.flores}", experiment_config['num_lines'],
+                      experiment_config['line_ids'], config.base['paths'].get('flores_index'))
+
+def format_header(config: Config, experiment_id: str, out_lang: str) -> str:
+    experiment_config = config.get_experiment_config(experiment_id)
+
+    return textwrap.dedent(f"""
         MODELNAME {experiment_config['model']}
         NLINES {experiment_config['num_lines']}
         STRATEGY_NAME {experiment_config['strategy']}
         SOURCEFILE {experiment_config['in_file']}
         SOURCE {experiment_config['source_language']}
-        TARGET {args.out_lang}
+        TARGET {out_lang}
     """).strip()
-    
-    translations = [result.strip() for result in results]
-    output = header + "\n\n" + "\n".join(translations)
-    
-    with open(args.out_file, 'w', encoding='utf-8') as f:
-        f.write(output)
+
+def process_results(results: List[str], config: Config, experiment_id: str, out_file: str, out_lang: str) -> None:
+    """Process and write results to output file"""
+    writer = OrderedWriter(out_file, format_header(config, experiment_id, out_lang))
+    for i, result in enumerate(results):
+        writer.add(i, result)
+    writer.close()
+
+def journal_metadata(config: Config, experiment_id: str, out_lang: str) -> Dict[str, Any]:
+    """What a language's journal must have been written for to be replayed"""
+    experiment_config = config.get_experiment_config(experiment_id)
+    metadata = {
+        'experiment_id': experiment_id,
+        'out_lang': out_lang,
+        'model': experiment_config['model'],
+        'strategy': experiment_config['strategy'],
+        'temperature': experiment_config['temperature'],
+        'num_lines': experiment_config['num_lines'],
+    }
+    if experiment_config['line_ids'] is not None:
+        metadata['line_ids'] = experiment_config['line_ids']
+    return metadata
+
+async def generate_language(
+    config: Config,
+    experiment_id: str,
+    out_file: str,
+    out_lang: str,
+    llm: Optional[LLM] = None,
+    cache: Optional[CompletionCache] = None,
+    resume: bool = False,
+    telemetry: Optional[Telemetry] = None,
+    results_db: Optional[ResultsDB] = None,
+) -> None:
+    """Generate, execute and write all calls for one target language.
+
+    Completed calls are journaled next to `out_file`; with `resume`, a journal
+    left by an interrupted run is replayed and only the missing calls are made.
+    Samples are also added to `results_db`, whose rows for the language are
+    cleared first unless resuming.
+
+    A strategy with an `adaptive` section samples each source line only until more samples
+    stop paying off (see iterAdaptiveCalls); the number of samples of each source line is
+    then saved beside `out_file` as `.sample_counts.npy`. A strategy with `pack_size` sends that
+    many source lines per request (see iterPackedCalls).
+    """
+    experiment_config = config.get_experiment_config(experiment_id)
+    strategy_config = config.get_strategy_config(experiment_config['strategy'])
+    calls = generateCalls(config, experiment_id, out_lang)
+    if llm is None:
+        llm = create_llm(config, experiment_config['model'])
+    journal = CallJournal(journal_path(out_file), journal_metadata(config, experiment_id, out_lang), resume=resume)
+    if results_db is not None and not resume:
+        results_db.clear_language(out_lang)
+    # numpy and the scoring modules are only imported for adaptive strategies
+    adaptive = None
+    if strategy_config.get('adaptive') is not None:
+        from utils.adaptive import adaptive_settings
+        adaptive = adaptive_settings(strategy_config)
+    pack_size = strategy_config.get('pack_size', 1)
+    if adaptive is not None and pack_size > 1:
+        raise ValueError(f"Strategy {experiment_config['strategy']} cannot use both adaptive sampling and pack_size")
+    counts_file = sample_counts_path(out_file)
+    # Results are streamed to out_file in call order as they complete
+    writer = OrderedWriter(out_file, format_header(config, experiment_id, out_lang))
+    try:
+        if adaptive is None:
+            if pack_size > 1:
+                results = iterPackedCalls(
+                    calls,
+                    pack_size,
+                    experiment_config['source_language'],
+                    strategy_config.get('pack_prompt_template', DEFAULT_PACK_TEMPLATE),
+                    llm=llm,
+                    cache=cache,
+                    journal=journal,
+                    telemetry=telemetry,
+                    results_db=results_db,
+                )
+            else:
+                results = iterCalls(
+                    calls,
+                    llm=llm,
+                    samples_per_request=strategy_config.get('samples_per_request', 1),
+                    cache=cache,
+                    journal=journal,
+                    telemetry=telemetry,
+                    results_db=results_db,
+                )
+            # Closing the generator on failure cancels its requests before the journal is closed
+            async with aclosing(results):
+                async for i, result in results:
+                    writer.add(i, result)
+            if os.path.exists(counts_file):
+                os.remove(counts_file)  # Left by an earlier adaptive run
+        else:
+            import numpy as np
+
+            references = read_target_references(config, experiment_id, out_lang) if adaptive['metric'] == 'chrf' else None
+            counts = np.zeros(len(calls) // strategy_config['passes'], dtype=np.int32)
+            # One entry per source line, its samples on consecutive lines
+            results = iterAdaptiveCalls(
+                calls,
+                strategy_config['passes'],
+                adaptive,
+                references,
+                llm=llm,
+                samples_per_request=strategy_config.get('samples_per_request', 1),
+                cache=cache,
+                journal=journal,
+                telemetry=telemetry,
+                results_db=results_db,
+            )
+            async with aclosing(results):
+                async for source, samples in results:
+                    writer.add(source, "\n".join(sample.strip() for sample in samples))
+                    counts[source] = len(samples)
+            np.save(counts_file, counts)
+            print(f"Adaptive sampling: {int(counts.sum())} of {len(calls)} samples, {counts.mean():.1f} per source line")
+        writer.close()
+    except BaseException:
+        writer.file.close()
+        journal.close()
+        print(f"Completed calls are journaled in {journal.path}; rerun with --resume to continue")
+        raise
+    journal.remove()
+    print(f"Results written to {out_file}")
+
+def share_of(stats: CallStats, parts: int, part: int) -> CallStats:
+    """
+    Part `part` of `parts` of a request's stats: its tokens split as evenly as integers allow.
+    Part 0 also carries the request's attempts and timing, so they are counted once.
+    """
+    share = CallStats()
+    if part == 0:
+        share.attempts = stats.attempts
+        share.queue_wait = stats.queue_wait
+        share.latency = stats.latency
+    share.prompt_tokens = stats.prompt_tokens // parts + (part < stats.prompt_tokens % parts)
+    share.completion_tokens = stats.completion_tokens // parts + (part < stats.completion_tokens % parts)
+    return share
+
+async def generate_languages(
+    config: Config,
+    experiment_id: str,
+    out_files: Dict[str, str],
+    llm: Optional[LLM] = None,
+    cache: Optional[CompletionCache] = None,
+    resume: bool = False,
+    telemetry: Optional[Telemetry] = None,
+    results_db: Optional[ResultsDB] = None,
+) -> Dict[str, BaseException]:
+    """Generate several target languages at once, asking for all of them in one request per sample.
+
+    `out_files` maps each target language to its output file. Each request asks for one source
+    line in every language of `out_files` as a JSON object keyed by language name (prompt from
+    the strategy's `multi_target_prompt_template`), with up to `samples_per_request` samples per
+    request as usual, and its reply is demultiplexed into the languages' output files, journals,
+    cache entries and results dataset rows, each getting an even share of the request's tokens.
+    Languages a reply leaves out or garbles are re-run on their own through iterCalls with their
+    single-language prompts as soon as the reply is in, and a request is finished once all its
+    languages are; as in iterCalls, requests are started at most a window ahead of the earliest
+    unfinished one. A language whose fallback calls fail for good is asked for no further lines.
+
+    Output files are the ones generate_language writes. Returns the languages that failed, with
+    their errors; the other languages are complete.
+    """
+    experiment_config = config.get_experiment_config(experiment_id)
+    strategy_config = config.get_strategy_config(experiment_config['strategy'])
+    if strategy_config.get('adaptive') is not None or strategy_config.get('pack_size', 1) > 1:
+        raise ValueError(f"Strategy {experiment_config['strategy']} cannot combine languages_per_request with adaptive sampling or pack_size")
+    if llm is None:
+        llm = create_llm(config, experiment_config['model'])
+    template = strategy_config.get('multi_target_prompt_template', DEFAULT_MULTI_TARGET_TEMPLATE)
+    languages = list(out_files)
+    passes = strategy_config['passes']
+    samples_per_request = strategy_config.get('samples_per_request', 1)
+
+    calls = {language: generateCalls(config, experiment_id, language) for language in languages}
+    journals = {language: CallJournal(journal_path(out_files[language]), journal_metadata(config, experiment_id, language), resume=resume)
+                for language in languages}
+    writers = {language: OrderedWriter(out_files[language], format_header(config, experiment_id, language)) for language in languages}
+    if results_db is not None and not resume:
+        for language in languages:
+            results_db.clear_language(language)
+
+    cache_key = lambda call: template_key(call, template)
+
+    # Journal and cache hits, per language
+    pending: Dict[str, set] = {}
+    for language in languages:
+        language_calls = calls[language]
+        hits, _ = replay_hits(language_calls, list(range(len(language_calls))), cache_key, cache, journals[language], telemetry, results_db)
+        for i in sorted(hits):
+            writers[language].add(i, hits[i])
+        pending[language] = {i for i in range(len(language_calls)) if i not in hits}
+
+    # One request per source line and run of passes still missing in some language
+    requests = []
+    for source_index in range(len(calls[languages[0]]) // passes):
+        needed = [p for p in range(passes) if any(source_index * passes + p in pending[language] for language in languages)]
+        requests.extend((source_index, needed[k:k + samples_per_request]) for k in range(0, len(needed), samples_per_request))
+
+    failures: Dict[str, List[Tuple[Dict[str, Any], BaseException]]] = {language: [] for language in languages}
+    fallen_back = 0
+
+    async def fall_back(language: str, indices: List[int]) -> None:
+        """Run a language's calls at `indices` on their own, noting those that fail for good"""
+        language_calls = calls[language]
+        try:
+            async with aclosing(iterCalls([language_calls[i] for i in indices], llm, samples_per_request, cache, journals[language],
+                                          telemetry=telemetry, results_db=results_db)) as results:
+                async for j, result in results:
+                    if cache is not None:
+                        cache.put_many([(cache_key(language_calls[indices[j]]), result)])
+                    writers[language].add(indices[j], result)
+        except LLMCallsFailed as e:
+            failures[language].extend(e.failures)
+
+    async def run_request(source_index: int, pass_indices: List[int]) -> None:
+        nonlocal fallen_back
+        indices = [source_index * passes + p for p in pass_indices]
+        wanted = [language for language in languages if not failures[language] and any(i in pending[language] for i in indices)]
+        if not wanted:
+            return
+        first = calls[wanted[0]][indices[0]]
+        prompt = multi_target_prompt(template, experiment_config['source_language'], wanted, first['source'])
+        system_prompt = strategy_config['system_prompt'].format(in_lang=experiment_config['source_language'], out_lang=", ".join(wanted))
+        stats = CallStats()
+        request_start = time.time()
+        request_failed = False
+        try:
+            replies = await llm.sample(prompt, system_prompt, first['temperature'], n=len(indices), stats=stats,
+                                       response_format={'type': 'json_object'})
+        except Exception as e:
+            if telemetry is not None:
+                telemetry.record(first, pass_indices, request_start, stats, error=e)
+            print(f"Multi-target request for source {source_index} failed ({type(e).__name__}: {e}); falling back to per-language calls")
+            replies = []
+            request_failed = True
+        parsed = [parse_multi_target_reply(reply, wanted) for reply in replies]
+        fallback = {}
+        for part, language in enumerate(wanted):
+            language_calls = calls[language]
+            done = [(i, translations[language]) for i, translations in zip(indices, parsed)
+                    if i in pending[language] and language in translations]
+            missing = [i for i in indices if i in pending[language] and i not in dict(done)]
+            if missing:
+                fallback[language] = missing
+            share = share_of(stats, len(wanted), part)
+            if telemetry is not None and (done or (part == 0 and not request_failed)):
+                # The request is recorded once, under its first language (above if it failed); the others record their samples
+                telemetry.record(language_calls[indices[0]], [language_calls[i]['pass_index'] for i, _ in done], request_start, share,
+                                 source='request' if part == 0 else 'multi_target')
+            if not done:
+                continue
+            add_samples(results_db, language_calls, [i for i, _ in done], [text for _, text in done], share)
+            if cache is not None:
+                cache.put_many([(cache_key(language_calls[i]), text) for i, text in done])
+            for i, text in done:
+                journals[language].record(language_calls[i]['source_index'], language_calls[i]['pass_index'], text)
+                writers[language].add(i, text)
+        fallen_back += sum(len(missing) for missing in fallback.values())
+        await asyncio.gather(*(fall_back(language, missing) for language, missing in fallback.items()))
+
+    window = 4 * (llm.limiter.max_limit if llm.limiter is not None else 64)
+    running = {}
+    next_request = 0
+    try:
+        while running or next_request < len(requests):
+            oldest = min(running.values(), default=next_request)
+            while next_request < len(requests) and next_request - oldest < window:
+                running[asyncio.ensure_future(run_request(*requests[next_request]))] = next_request
+                next_request += 1
+            done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                running.pop(task)
+                task.result()
+    except BaseException:
+        for task in running:
+            task.cancel()
+        for language in languages:
+            writers[language].file.close()
+            journals[language].close()
+        raise
+    print(f"Multi-target: {len(requests)} requests for {len(languages)} languages; "
+          f"{fallen_back} samples fell back to per-language calls")
+
+    failed = {}
+    for language in languages:
+        if failures[language]:
+            writers[language].file.close()
+            journals[language].close()
+            details = "\n".join(
+                f"  source {call['source_index']} pass {call['pass_index']}: {type(error).__name__}: {error}"
+                for call, error in sorted(failures[language], key=lambda failure: (failure[0]['source_index'], failure[0]['pass_index']))
+            )
+            failed[language] = LLMCallsFailed(f"{len(failures[language])} call(s) to {llm.model_name} for {language} failed:\n{details}", failures[language])
+            print(f"Completed calls are journaled in {journals[language].path}; rerun with --resume to continue")
+            continue
+        writers[language].close()
+        if os.path.exists(sample_counts_path(out_files[language])):
+            os.remove(sample_counts_path(out_files[language]))  # Left by an earlier adaptive run
+        journals[language].remove()
+        print(f"Results written to {out_files[language]}")
+    return failed
 
 async def main():
     parser = argparse.ArgumentParser(description="Language Translation benchmark")
     parser.add_argument("experiment_id", help="Experiment ID from config")
     parser.add_argument("out_file", help="Output file")
     parser.add_argument("out_lang", help="Output language")
+    parser.add_argument("--no_cache", action="store_true", help="Do not read or write the completion cache")
+    parser.add_argument("--cache_read_only", action="store_true", help="Read the completion cache without writing to it")
+    parser.add_argument("--resume", action="store_true", help="Replay the journal of an interrupted run and make only the missing calls")
+    parser.add_argument("--telemetry", help="Per-call telemetry JSONL file (default: telemetry.jsonl next to out_file)")
+    parser.add_argument("--run_id", help="Run id for telemetry records; when set, the caller writes the run summary")
+    parser.add_argument("--retry_state", help="JSON file to resume the retry budget and circuit breaker from and save them to")
 
     args = parser.parse_args()
     config = Config()
+    cache = None if args.no_cache else open_cache(config.base.get('cache'), read_only=args.cache_read_only or None)
+    telemetry = Telemetry(args.telemetry or os.path.join(os.path.dirname(args.out_file), 'telemetry.jsonl'), args.run_id)
+    results_db = ResultsDB(results_path(os.path.dirname(args.out_file)))
+    llm = create_llm(config, config.get_experiment_config(args.experiment_id)['model'])
+    if args.retry_state:
+        load_retry_state(args.retry_state, llm.retry_budget, llm.breaker)
 
     try:
-        calls = generateCalls(config, args.experiment_id, args.out_lang)
-        results = await executeCalls(calls)
-        process_results(results, args, config)
-        print(f"Results written to {args.out_file}")
+        await generate_language(config, args.experiment_id, args.out_file, args.out_lang, llm=llm, cache=cache, resume=args.resume, telemetry=telemetry, results_db=results_db)
     except Exception as e:
         print(f"Error: {str(e)}")
         raise
+    finally:
+        if args.retry_state:
+            save_retry_state(args.retry_state, llm.retry_budget, llm.breaker)
+        await close_http_client()
+        telemetry.close()
+        results_db.close()
+        if args.run_id is None:
+            write_summary(telemetry.path, telemetry.run_id, model_prices(config.models))
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -1,49 +1,105 @@
 import sys
 import os
-import matplotlib.pyplot as plt
 import numpy as np
-from math import comb
 from utils.config import Config
+from utils.coverage import expected_max_curves, score_file_curves, bootstrap_bands, average_bootstrap_band
+from utils.scores import load_score_matrix
+from utils.results_db import ResultsDB, results_path
+import json
+import hashlib
 import argparse
+from concurrent.futures import ProcessPoolExecutor
 import dotenv
 
 dotenv.load_dotenv()   
 
+# Bump when the drawing code changes, so every figure is rendered again
+GRAPH_VERSION = 2
+GRAPH_MANIFEST = '.graphs_manifest.json'
+
 def calculate_average_max_for_all_n(group):
-    results = []
-    group_size = len(group)
-    sorted_group = sorted(group)
-     # Sort the group in descending order
-    
-    for n in range(1, group_size + 1):
-        sum_of_maximums = sum(sorted_group[k-1] * comb(k-1, n-1) for k in range(n, group_size + 1))
-        average_max = sum_of_maximums / comb(group_size, n)
-        results.append(average_max)
-    
-    return results
+    """Expected max of n scores drawn from `group` without replacement, for n = 1..len(group)"""
+    return expected_max_curves(np.asarray([group], dtype=np.float64))[0].tolist()
 
 def get_all_groups(filename, group_size=100):
-    all_groups = []
-    current_group = []
-    with open(filename, 'r') as file:
-        for line in file:
-            try:
-                number = float(line.strip())
-                current_group.append(number)
-                if len(current_group) == group_size:
-                    all_groups.append(current_group)
-                    current_group = []
-            except ValueError:
-                continue  # Skip non-numeric lines
-    if current_group:  # Add the last group if it's not empty
-        all_groups.append(current_group)
-    return all_groups
+    """(sources, group_size) scores of an .eval file, memory-mapped from its .npy store"""
+    return load_score_matrix(filename, group_size)
+
+def get_dataset_groups(experiment_id, metric, group_size):
+    """(sources, group_size) scores of one metric per language from the experiment's results dataset,
+    keyed like the .eval files; sources with fewer scores (adaptive sampling) are NaN-padded"""
+    results_db = ResultsDB(results_path(f'experiments/{experiment_id}'), read_only=True)
+    groups = {}
+    for language in results_db.languages():
+        matrix = results_db.score_matrix(language, metric)
+        if not matrix.size:
+            continue
+        if matrix.shape[1] > group_size:
+            print(f'Warning: ignoring {language} {metric} scores of passes beyond {group_size}')
+        groups[f'{language}_scores.eval'] = np.pad(matrix[:, :group_size], ((0, 0), (0, max(group_size - matrix.shape[1], 0))), constant_values=np.nan)
+    results_db.close()
+    return groups
+
+def graph_hash(spec):
+    """Hash of everything a figure is drawn from"""
+    payload = json.dumps([GRAPH_VERSION, spec['curve'], spec['baselines'], spec['title'], spec['band'], spec['band_label']])
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def render_graph(spec):
+    """Worker: draw one expected-max curve with its baselines to spec['output_file']"""
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    curve = spec['curve']
+    fig, ax = plt.subplots(figsize=(12, 6))
+    ax.plot(range(1, len(curve) + 1), curve)
+    if spec['band'] is not None:
+        ax.fill_between(range(1, len(curve) + 1), spec['band'][0], spec['band'][1], alpha=0.2, label=spec['band_label'])
+    for label, color, value in spec['baselines']:
+        ax.axhline(y=value, color=color, linestyle='--', label=f'{label} Base Line: {value:.4f}')
+    ax.set_xlabel('n (number of elements chosen)')
+    ax.set_ylabel('Average Max Score')
+    ax.set_title(spec['title'])
+    ax.grid(True)
+    ax.legend()
+    plt.tight_layout()
+    plt.savefig(spec['output_file'])
+    plt.close(fig)
+    return spec['output_file']
+
+def render_graphs(specs, output_directory, workers, force=False):
+    """
+    Render the figures whose hash differs from the one recorded in the directory's manifest
+    (or whose image is missing), in a process pool, then record the new hashes.
+    """
+    manifest_path = os.path.join(output_directory, GRAPH_MANIFEST)
+    manifest = {}
+    if os.path.exists(manifest_path) and not force:
+        with open(manifest_path, 'r') as f:
+            manifest = json.load(f)
+
+    stale = [spec for spec in specs
+             if manifest.get(os.path.basename(spec['output_file'])) != graph_hash(spec) or not os.path.exists(spec['output_file'])]
+    print(f'Rendering {len(stale)} of {len(specs)} graphs')
+    if len(stale) > 1 and workers > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(stale))) as pool:
+            list(pool.map(render_graph, stale))
+    else:
+        for spec in stale:
+            render_graph(spec)
+    for spec in stale:
+        manifest[os.path.basename(spec['output_file'])] = graph_hash(spec)
+        print(f"Graph saved for {spec['name']}")
+
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
 
 def get_common_languages(gpt4o_baseline, deepl_baseline, google_baseline):
     gpt4o_langs = set(gpt4o_baseline.keys())
     deepl_langs = set(deepl_baseline.keys())
     google_langs = set(google_baseline.keys())
-    return list(set.intersection(gpt4o_langs, deepl_langs, google_langs))
+    return sorted(set.intersection(gpt4o_langs, deepl_langs, google_langs))
 
 def calculate_average(baseline, languages):
     return sum(baseline[lang] for lang in languages) / len(languages)
@@ -52,6 +108,11 @@ if __name__ == "__main__":
 
     parser = argparse.ArgumentParser()
     parser.add_argument('--experiment_id', type=str, required=True)
+    parser.add_argument('--metric', type=str, help='Read scores of this metric from the experiment results dataset instead of the .eval files')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Processes rendering figures')
+    parser.add_argument('--force', action='store_true', help='Render every figure even if its inputs are unchanged')
+    parser.add_argument('--bootstrap', type=int, default=10000, help='Bootstrap resamples over source lines for confidence bands (0 to disable)')
+    parser.add_argument('--confidence', type=float, default=95.0, help='Confidence level of the bands, in percent')
     args = parser.parse_args()
 
     if not args.experiment_id:
@@ -61,7 +122,7 @@ if __name__ == "__main__":
     
     directory = Config.base['paths']['base_path'] + '/evals/' + f'{args.experiment_id}'
     print(directory)
-    if not os.path.exists(directory):
+    if args.metric is None and not os.path.exists(directory):
         print(f'Experiment {args.experiment_id} does not exist')
         exit(1)
     output_directory = Config.base['paths']['base_path'] + '/evals/' + f'{args.experiment_id}_graphs'
@@ -73,7 +134,28 @@ if __name__ == "__main__":
     if not os.path.exists(output_directory):
         os.makedirs(output_directory, exist_ok=True)
     
-    all_languages_results = []
+    # Mean expected-max curve per language, from the curve sidecars of unchanged .eval files;
+    # the others are computed in one matrix product
+    if args.metric is not None:
+        dataset_groups = get_dataset_groups(args.experiment_id, args.metric, group_size)
+        eval_files = list(dataset_groups)
+        group_curves = {filename: expected_max_curves(groups) for filename, groups in dataset_groups.items()}
+        language_curves = {filename: curves.mean(axis=0) for filename, curves in group_curves.items()}
+    else:
+        eval_files = sorted(filename for filename in os.listdir(directory) if filename.endswith('.eval'))
+        file_curves = score_file_curves([os.path.join(directory, filename) for filename in eval_files], group_size)
+        group_curves = {filename: file_curves[os.path.join(directory, filename)][0] for filename in eval_files}
+        language_curves = {filename: file_curves[os.path.join(directory, filename)][1] for filename in eval_files}
+
+    # Percentile bands of the mean curves over bootstrap resamples of source lines
+    band_label = f'{args.confidence:g}% bootstrap band ({args.bootstrap} resamples)'
+    def band(low_high):
+        return [low_high[0].tolist(), low_high[1].tolist()] if low_high is not None else None
+    language_bands = bootstrap_bands(group_curves, args.bootstrap, args.confidence, workers=args.workers) if args.bootstrap else {}
+    def average_band(filenames):
+        if not args.bootstrap or not filenames:
+            return None
+        return band(average_bootstrap_band([group_curves[filename] for filename in filenames], args.bootstrap, args.confidence))
     
     # Exact GPT-4O baseline averages provided
     averages = {
@@ -135,103 +217,47 @@ if __name__ == "__main__":
         'Chinese_scores.eval': 0.7030
     }
     
-    for filename in os.listdir(directory):
-        if filename.endswith('.eval'):
-            file_path = os.path.join(directory, filename)
-            
-            all_groups = get_all_groups(file_path, group_size)
-            all_results = [calculate_average_max_for_all_n(group) for group in all_groups]
-            average_results = np.mean(all_results, axis=0)
-            
-            all_languages_results.append(average_results)
-            
-            # Create and save individual language graph
-            fig, ax = plt.subplots(figsize=(12, 6))
-            ax.plot(range(1, len(average_results) + 1), average_results)
-            
-            # Add baseline lines
-            language_average = averages.get(filename)
-            if language_average is not None:
-                ax.axhline(y=language_average, color='r', linestyle='--', label=f'GPT-4O Base Line: {language_average:.4f}')
-            
-            deepl_average = deepl_baseline.get(filename)
-            if deepl_average is not None:
-                ax.axhline(y=deepl_average, color='g', linestyle='--', label=f'DeepL Base Line: {deepl_average:.4f}')
-            
-            google_average = google_baseline.get(filename)
-            if google_average is not None:
-                ax.axhline(y=google_average, color='b', linestyle='--', label=f'Google Base Line: {google_average:.4f}')
-            
-            # Add blue dashed line at n = 26 and shade area below
-            # ax.axvline(x=26, color='b', linestyle='--')
-            #ax.fill_between(range(1, 27), ax.get_ylim()[0], average_results[:26], alpha=0.2, color='b', label='Pricing cheaper than base line')
-            
-            ax.set_xlabel('n (number of elements chosen)')
-            ax.set_ylabel('Average Max Score')
-            ax.set_title(f'Average Max Score for Different n Across All Groups in {filename}')
-            ax.grid(True)
-            ax.legend()
-            plt.tight_layout()
-            
-            output_file = os.path.join(output_directory, f'{os.path.splitext(filename)[0]}_graph.png')
-            plt.savefig(output_file)
-            plt.close()
-            
-            print(f"Graph saved for {filename}")
-    
-    # Create and save the average across all languages graph
-    all_languages_average = np.mean(all_languages_results, axis=0)
-    
-    fig, ax = plt.subplots(figsize=(12, 6))
-    ax.plot(range(1, len(all_languages_average) + 1), all_languages_average)
-    
-    # Add red dashed line for overall average
-    ax.axhline(y=overall_average, color='r', linestyle='--', label=f'GPT-4O Base Line: {overall_average:.4f}')
-    
-    # Add blue dashed line at n = 26 and shade area below
-    # ax.axvline(x=26, color='b', linestyle='--')
-    #ax.fill_between(range(1, 27), ax.get_ylim()[0], all_languages_average[:26], alpha=0.2, color='b', label='Pricing cheaper than base line')
-    
-    ax.set_xlabel('n (number of elements chosen)')
-    ax.set_ylabel('Average Max Score')
-    ax.set_title('Average Max Score for Different n Across All Languages')
-    ax.grid(True)
-    ax.legend()
-    plt.tight_layout()
-    
-    output_file = os.path.join(output_directory, 'all_languages_average_graph.png')
-    plt.savefig(output_file)
-    plt.close()
-    
-    print("Graph saved for average across all languages")
-
-    # Create and save the average across common languages graph
-    common_languages = get_common_languages(averages, deepl_baseline, google_baseline)
-    gpt4o_common_average = calculate_average(averages, common_languages)
-    deepl_common_average = calculate_average(deepl_baseline, common_languages)
-    google_common_average = calculate_average(google_baseline, common_languages)
+    # One spec per figure, keyed by output file; its hash covers the curve, baselines and labels
+    specs = []
+    for filename in eval_files:
+        baselines = [(label, color, baseline.get(filename)) for label, color, baseline in
+                     (('GPT-4O', 'r', averages), ('DeepL', 'g', deepl_baseline), ('Google', 'b', google_baseline))]
+        specs.append({
+            'output_file': os.path.join(output_directory, f'{os.path.splitext(filename)[0]}_graph.png'),
+            'curve': language_curves[filename].tolist(),
+            'baselines': [(label, color, value) for label, color, value in baselines if value is not None],
+            'title': f'Average Max Score for Different n Across All Groups in {filename}',
+            'band': band(language_bands.get(filename)),
+            'band_label': band_label,
+            'name': filename,
+        })
 
-    common_languages_average = np.mean([result for i, result in enumerate(all_languages_results) 
-                                      if os.listdir(directory)[i] in common_languages], axis=0)
+    if language_curves:
+        specs.append({
+            'output_file': os.path.join(output_directory, 'all_languages_average_graph.png'),
+            'curve': np.mean(list(language_curves.values()), axis=0).tolist(),
+            'baselines': [('GPT-4O', 'r', overall_average)],
+            'title': 'Average Max Score for Different n Across All Languages',
+            'band': average_band(eval_files),
+            'band_label': band_label,
+            'name': 'average across all languages',
+        })
 
-    fig, ax = plt.subplots(figsize=(12, 6))
-    ax.plot(range(1, len(common_languages_average) + 1), common_languages_average)
-
-    # Add baseline lines for common languages averages
-    ax.axhline(y=gpt4o_common_average, color='r', linestyle='--', label=f'GPT-4O Base Line: {gpt4o_common_average:.4f}')
-    ax.axhline(y=deepl_common_average, color='g', linestyle='--', label=f'DeepL Base Line: {deepl_common_average:.4f}')
-    ax.axhline(y=google_common_average, color='b', linestyle='--', label=f'Google Base Line: {google_common_average:.4f}')
-
-    ax.set_xlabel('n (number of elements chosen)')
-    ax.set_ylabel('Average Max Score')
-    ax.set_title('Average Max Score for Different n Across Common Languages')
-    ax.grid(True)
-    ax.legend()
-    plt.tight_layout()
-
-    output_file = os.path.join(output_directory, 'common_languages_average_graph.png')
-    plt.savefig(output_file)
-    plt.close()
+    common_languages = get_common_languages(averages, deepl_baseline, google_baseline)
+    common_files = [filename for filename in eval_files if filename in common_languages]
+    common_curves = [language_curves[filename] for filename in common_files]
+    if common_curves:
+        specs.append({
+            'output_file': os.path.join(output_directory, 'common_languages_average_graph.png'),
+            'curve': np.mean(common_curves, axis=0).tolist(),
+            'baselines': [('GPT-4O', 'r', calculate_average(averages, common_languages)),
+                          ('DeepL', 'g', calculate_average(deepl_baseline, common_languages)),
+                          ('Google', 'b', calculate_average(google_baseline, common_languages))],
+            'title': 'Average Max Score for Different n Across Common Languages',
+            'band': average_band(common_files),
+            'band_label': band_label,
+            'name': 'average across common languages',
+        })
 
-    print("Graph saved for average across common languages")
-    print("All graphs have been generated and saved.")
\ No newline at end of file
+    render_graphs(specs, output_directory, args.workers, args.force)
+    print("All graphs have been generated and saved.")
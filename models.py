@@ -1,88 +1,265 @@
 import os
+import re
 import time
 import asyncio
-from typing import Optional, Dict, Any, TypeVar, Callable, Awaitable
-from openai import AsyncOpenAI, RateLimitError
+import weakref
+from typing import TYPE_CHECKING, Optional, Dict, Any, List, Tuple, TypeVar, Callable, Awaitable
 from dotenv import load_dotenv
+from utils.scheduler import AdaptiveLimiter, cooldown_from_headers
+from utils.telemetry import CallStats
+from utils.retry import RetryPolicy, RetryBudget, CircuitBreaker
 
 load_dotenv()
 
+# openai and httpx are imported where they are first needed, so that importing this module
+# (and runs served entirely from the cache or a journal) does not pay for them.
+if TYPE_CHECKING:
+    import httpx
+    from openai import AsyncOpenAI
+
 T = TypeVar('T')  # Type variable for return type of retried function
 
+_http_clients: 'weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]' = weakref.WeakKeyDictionary()
+
+def get_http_client(
+    max_connections: int = 256,
+    max_keepalive_connections: int = 128,
+    keepalive_expiry: float = 120.0,
+    http2: bool = False,
+    connect_timeout: float = 10.0,
+    read_timeout: float = 600.0,
+    write_timeout: float = 30.0,
+    pool_timeout: float = 60.0,
+) -> 'httpx.AsyncClient':
+    """
+    Return the connection pool shared by every LLM on the running event loop, creating it on first use.
+
+    Connections are kept alive between requests so that TCP and TLS setup is paid once per
+    connection rather than per request. The read timeout is long because completions with
+    many samples can take minutes. HTTP/2 needs the `h2` package (pip install httpx[http2])
+    and is skipped with a warning without it.
+    """
+    import httpx
+
+    loop = asyncio.get_running_loop()
+    client = _http_clients.get(loop)
+    if client is None or client.is_closed:
+        if http2:
+            try:
+                import h2  # noqa: F401
+            except ImportError:
+                print("HTTP/2 requested but the h2 package is not installed, using HTTP/1.1")
+                http2 = False
+        client = httpx.AsyncClient(
+            http2=http2,
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive_connections,
+                keepalive_expiry=keepalive_expiry,
+            ),
+            timeout=httpx.Timeout(connect=connect_timeout, read=read_timeout, write=write_timeout, pool=pool_timeout),
+        )
+        _http_clients[loop] = client
+    return client
+
+async def close_http_client() -> None:
+    """Close the running event loop's shared connection pool, if one was opened"""
+    client = _http_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
+def rejected_parameter(error: Exception, parameter: str) -> bool:
+    """Whether a 400 response names `parameter`, either as its `param` field or as a word of its message"""
+    body = getattr(error, 'body', None)
+    if isinstance(body, dict):
+        body = body.get('error', body)
+    if isinstance(body, dict) and body.get('param') == parameter:
+        return True
+    message = body.get('message') if isinstance(body, dict) else None
+    text = f"{message or ''} {str(error)}"
+    return re.search(rf"(?<![\w.-]){re.escape(parameter)}(?![\w-])", text) is not None
+
 class LLMError(Exception):
     """Base exception for LLM-related errors"""
+    retryable = False
+
+class LLMUpstreamError(LLMError):
+    """Transient error reported by the provider in the response body, such as a 5xx from upstream"""
+    retryable = True
+
+class LLMCircuitOpenError(LLMError):
+    """Raised without making a request while a model's circuit breaker is open"""
     pass
 
+class LLMCallsFailed(LLMError):
+    """Raised after a batch of calls finishes with some calls failed, listing each failure"""
+    def __init__(self, message: str, failures: List[Tuple[Dict[str, Any], BaseException]]):
+        super().__init__(message)
+        self.failures = failures
+
+class LLMUnsupportedParameterError(LLMError):
+    """Raised when a provider rejects a request parameter such as `n` or `response_format`"""
+    def __init__(self, message: str, parameter: str = 'n'):
+        super().__init__(message)
+        self.parameter = parameter
+
 class LLMRateLimitError(LLMError):
+    retryable = True
+
     def __init__(self, message: str, cooldown: int = 60, headers: Dict = None):
         super().__init__(message)
         self.cooldown = cooldown
         self.headers = headers or {}
 
 class LLM:
-    def __init__(self, model_name: str, session: Optional[Any] = None):
+    def __init__(
+        self,
+        model_name: str,
+        session: Optional[Any] = None,
+        limiter: Optional[AdaptiveLimiter] = None,
+        max_samples_per_request: int = 128,
+        base_url: Optional[str] = None,
+        retry_policy: Optional[RetryPolicy] = None,
+        retry_budget: Optional[RetryBudget] = None,
+        breaker: Optional[CircuitBreaker] = None,
+        http_settings: Optional[Dict[str, Any]] = None,
+    ):
         """Initialize LLM with OpenRouter configuration"""
         self.model_name = model_name
         self.session = session
+        self.limiter = limiter
+        self.max_samples_per_request = max_samples_per_request
+        self.supports_json_mode = True
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.retry_budget = retry_budget or RetryBudget()
+        self.breaker = breaker or CircuitBreaker()
+        self.http_settings = http_settings or {}
         
-        api_key = os.getenv("OPENROUTER_API_KEY")
-        if not api_key:
+        self.api_key = os.getenv("OPENROUTER_API_KEY")
+        if not self.api_key:
             raise ValueError("OPENROUTER_API_KEY environment variable is not set")
-            
-        self.client = AsyncOpenAI(
-            base_url="https://openrouter.ai/api/v1",
-            api_key=api_key,
-        )
+        self.base_url = base_url or os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1")
+        self._client: Optional['AsyncOpenAI'] = None
 
-    async def _retry_with_exponential_backoff(
-        self,
-        func: Callable[[], Awaitable[T]],
-        max_retries: int = 5,
-        initial_delay: float = 1.0,
-        max_delay: float = 60.0,
-        exponential_base: float = 2.0,
-    ) -> T:
+    @property
+    def client(self) -> 'AsyncOpenAI':
+        """OpenAI client on the shared connection pool of the running event loop"""
+        from openai import AsyncOpenAI
+
+        http_client = get_http_client(**self.http_settings)
+        if self._client is None or self._http_client is not http_client:
+            self._http_client = http_client
+            self._client = AsyncOpenAI(
+                base_url=self.base_url,
+                api_key=self.api_key,
+                http_client=http_client,
+                # Retries are handled by _call_with_retries only
+                max_retries=0,
+            )
+        return self._client
+
+    async def _call_with_retries(self, func: Callable[[], Awaitable[T]]) -> T:
         """
-        Retry an async function with exponential backoff.
-        
-        Args:
-            func: Async function to retry
-            max_retries: Maximum number of retries
-            initial_delay: Initial delay between retries in seconds
-            max_delay: Maximum delay between retries in seconds
-            exponential_base: Base for exponential backoff
-            
-        Returns:
-            The result of the function call
-            
+        Run one logical call under the retry policy, retry budget and circuit breaker.
+
+        Rate limits wait for the limiter's global cooldown (or the error's cooldown without a
+        limiter). Transient failures back off with decorrelated jitter and count towards the
+        circuit breaker. Non-retryable errors are raised immediately.
+
         Raises:
-            LLMError: If all retries are exhausted
+            LLMCircuitOpenError: If the circuit breaker for this model is open
+            LLMError: If attempts, the per-call deadline or the retry budget run out
         """
-        retries = 0
-        delay = initial_delay
-        last_exception = None
+        from openai import APIStatusError, APIConnectionError
+
+        policy = self.retry_policy
+        start = time.monotonic()
+        delay = None
+        attempt = 0
+        self.retry_budget.on_call()
 
-        while retries < max_retries:
+        while True:
+            if self.breaker.is_open:
+                raise LLMCircuitOpenError(f"Circuit breaker open for {self.model_name} after {self.breaker.failures} consecutive failures")
+            attempt += 1
             try:
-                return await func()
+                result = await func()
+                self.breaker.on_success()
+                return result
             except LLMRateLimitError as e:
                 last_exception = e
-                # Use the cooldown from the rate limit error if available
-                delay = min(e.cooldown, max_delay)
-                print(f"Rate limit hit, waiting {delay} seconds before retry {retries + 1}/{max_retries}")
-            except Exception as e:
-                if isinstance(e, LLMError):
-                    # Don't retry other LLM errors
+                if self.limiter is not None:
+                    # Pause the whole pool rather than sleeping in this task only
+                    self.limiter.on_rate_limit(e.cooldown, e.headers)
+                    wait = self.limiter.paused_for
+                else:
+                    wait = min(e.cooldown, policy.max_delay)
+            except LLMError as e:
+                if not e.retryable:
                     raise
                 last_exception = e
-                print(f"Error occurred, retrying in {delay} seconds (retry {retries + 1}/{max_retries})")
-            
-            await asyncio.sleep(delay)
-            delay = min(delay * exponential_base, max_delay)
-            retries += 1
+                self.breaker.on_failure()
+                wait = delay = policy.next_delay(delay)
+            except APIStatusError as e:
+                if e.status_code < 500 and e.status_code != 408:
+                    raise LLMError(f"Error from {self.model_name}: {str(e)}") from e
+                last_exception = e
+                self.breaker.on_failure()
+                wait = delay = policy.next_delay(delay)
+            except (APIConnectionError, asyncio.TimeoutError) as e:
+                last_exception = e
+                self.breaker.on_failure()
+                wait = delay = policy.next_delay(delay)
+
+            if attempt >= policy.max_attempts:
+                raise LLMError(f"{self.model_name} failed after {attempt} attempts. Last error: {str(last_exception)}") from last_exception
+            if time.monotonic() - start + wait > policy.deadline:
+                raise LLMError(f"{self.model_name} call would exceed its {policy.deadline:.0f}s deadline. Last error: {str(last_exception)}") from last_exception
+            if not self.retry_budget.can_retry():
+                raise LLMError(f"Retry budget exhausted for {self.model_name}. Last error: {str(last_exception)}") from last_exception
+            self.retry_budget.on_retry()
 
-        # If we've exhausted all retries, raise the last exception
-        raise LLMError(f"Failed after {max_retries} retries. Last error: {str(last_exception)}")
+            print(f"{type(last_exception).__name__} from {self.model_name}, retrying in {wait:.1f} seconds (attempt {attempt + 1}/{policy.max_attempts})")
+            if isinstance(last_exception, LLMRateLimitError) and self.limiter is not None:
+                await self.limiter.wait_ready()
+            else:
+                await asyncio.sleep(wait)
+
+    async def _create(self, stats: Optional[CallStats] = None, **kwargs) -> Tuple[Any, Dict[str, str], float]:
+        """
+        Issue one chat completion request, holding a limiter slot for its duration.
+
+        Returns the parsed completion, the response headers and the request latency.
+        HTTP 429 responses are converted to LLMRateLimitError. Queue wait, latency and
+        token usage are added to `stats` if given.
+        """
+        from openai import RateLimitError
+
+        queued = time.monotonic()
+        if self.limiter is not None:
+            await self.limiter.acquire()
+        start = time.monotonic()
+        if stats is not None:
+            stats.attempts += 1
+            stats.queue_wait += start - queued
+        try:
+            raw = await self.client.chat.completions.with_raw_response.create(**kwargs)
+        except RateLimitError as e:
+            headers = dict(e.response.headers)
+            raise LLMRateLimitError(
+                f"Rate limit exceeded for {self.model_name}: {str(e)}",
+                cooldown=cooldown_from_headers(headers),
+                headers=headers
+            )
+        finally:
+            if self.limiter is not None:
+                await self.limiter.release()
+            if stats is not None:
+                stats.latency += time.monotonic() - start
+        completion = raw.parse()
+        if stats is not None:
+            stats.add_usage(getattr(completion, 'usage', None))
+        return completion, dict(raw.headers), time.monotonic() - start
 
     async def __call__(
         self, 
@@ -91,59 +268,135 @@ class LLM:
         temperature: float = 0.0,
     ) -> str:
         """Make an async call to the LLM with retry logic"""
-        async def _make_call():
-            completion = await self.client.chat.completions.create(
+        return (await self.sample(prompt, system_prompt, temperature, n=1))[0]
+
+    async def sample(
+        self,
+        prompt: str,
+        system_prompt: str,
+        temperature: float = 0.0,
+        n: int = 1,
+        stats: Optional[CallStats] = None,
+        response_format: Optional[Dict[str, Any]] = None,
+    ) -> List[str]:
+        """
+        Draw `n` completions for one prompt, asking for several per request with the `n` parameter.
+
+        Providers that cap `n` return fewer choices than requested and providers that ignore it
+        return one; either way the remaining samples are requested in further calls, and the
+        largest number of choices seen in a short response becomes this model's cap.
+        Providers that reject `n` outright fall back to single-sample calls.
+        A `response_format` such as `{'type': 'json_object'}` (JSON mode) is sent while the
+        provider accepts it; once rejected, the prompt alone has to ask for the format.
+        Attempts, timing and token usage of every request made are added to `stats`.
+        """
+        samples = []
+        while len(samples) < n:
+            requested = min(n - len(samples), self.max_samples_per_request)
+            requested_format = response_format if self.supports_json_mode else None
+            try:
+                returned, contents = await self._call_with_retries(
+                    lambda: self._make_sample_call(prompt, system_prompt, temperature, requested, stats, requested_format)
+                )
+            except LLMUnsupportedParameterError as e:
+                if e.parameter == 'response_format':
+                    print(f"{self.model_name} rejected response_format, falling back to prompt-only formatting")
+                    self.supports_json_mode = False
+                else:
+                    print(f"{self.model_name} rejected n={requested}, falling back to single samples")
+                    self.max_samples_per_request = 1
+                continue
+            if returned < requested:
+                self.max_samples_per_request = max(1, returned)
+            samples.extend(contents[:requested])
+        return samples
+
+    async def _make_sample_call(
+        self,
+        prompt: str,
+        system_prompt: str,
+        temperature: float,
+        n: int,
+        stats: Optional[CallStats] = None,
+        response_format: Optional[Dict[str, Any]] = None,
+    ) -> Tuple[int, List[str]]:
+        """Make one request for `n` choices, returning the number of choices and their valid contents"""
+        from openai import BadRequestError
+
+        kwargs = {}
+        if n > 1:
+            kwargs['n'] = n
+        if response_format is not None:
+            kwargs['response_format'] = response_format
+        try:
+            completion, response_headers, latency = await self._create(
+                stats=stats,
                 model=self.model_name,
                 messages=[
                     {"role": "system", "content": system_prompt},
                     {"role": "user", "content": prompt}
                 ],
                 temperature=temperature,
+                **kwargs
             )
-            
-            # Check if completion is None
-            if completion is None:
-                raise LLMError(f"Received null response from {self.model_name}")
-                
-            # Check for error field in response
-            if getattr(completion, 'error', None):
-                error_data = completion.error
-                # Check if it's a rate limit error
-                if isinstance(error_data, dict):
-                    message = error_data.get('message', '')
-                    code = error_data.get('code')
-                    metadata = error_data.get('metadata', {})
-                    headers = metadata.get('headers', {})
-                    
-                    if code == 429 or 'rate limit' in message.lower():
-                        # Get reset time from headers, default to 60 seconds
-                        reset_time = int(headers.get('X-RateLimit-Reset', '0'))
-                        current_time = int(time.time() * 1000)  # Convert to milliseconds
-                        cooldown = max(60, (reset_time - current_time) // 1000)  # Convert to seconds
-                        
-                        raise LLMRateLimitError(
-                            f"Rate limit exceeded for {self.model_name}. Reset at {reset_time}",
-                            cooldown=cooldown,
-                            headers=headers
-                        )
-                raise LLMError(f"Error from {self.model_name}: {error_data}")
-            
-            # Check if choices exist and have content
-            if not hasattr(completion, 'choices') or not completion.choices:
-                raise LLMError(f"No choices in response from {self.model_name}")
-                
+        except BadRequestError as e:
+            # Other 400s (context length, content policy) are not a reason to stop sending n or response_format
+            if response_format is not None and rejected_parameter(e, 'response_format'):
+                raise LLMUnsupportedParameterError(f"{self.model_name} does not accept response_format: {str(e)}", parameter='response_format')
+            if n > 1 and rejected_parameter(e, 'n'):
+                raise LLMUnsupportedParameterError(f"{self.model_name} does not accept n={n}: {str(e)}")
+            raise
+
+        # Check if completion is None
+        if completion is None:
+            raise LLMError(f"Received null response from {self.model_name}")
+
+        # Check for error field in response
+        if getattr(completion, 'error', None):
+            error_data = completion.error
+            # Check if it's a rate limit error
+            if isinstance(error_data, dict):
+                message = error_data.get('message', '')
+                code = error_data.get('code')
+                metadata = error_data.get('metadata', {})
+                headers = metadata.get('headers', {})
+
+                if code == 429 or 'rate limit' in message.lower():
+                    # Get reset time from headers, default to 60 seconds
+                    reset_time = headers.get('X-RateLimit-Reset', '0')
+                    cooldown = cooldown_from_headers(headers)
+
+                    raise LLMRateLimitError(
+                        f"Rate limit exceeded for {self.model_name}. Reset at {reset_time}",
+                        cooldown=cooldown,
+                        headers=headers
+                    )
+                if isinstance(code, int) and (code >= 500 or code == 408):
+                    raise LLMUpstreamError(f"Upstream error from {self.model_name}: {error_data}")
+            raise LLMError(f"Error from {self.model_name}: {error_data}")
+
+        # Check if choices exist and have content
+        if not hasattr(completion, 'choices') or not completion.choices:
+            raise LLMError(f"No choices in response from {self.model_name}")
+
+        contents = []
+        first_error = None
+        for choice in completion.choices:
             # Check for refusal in message
-            message = completion.choices[0].message
+            message = choice.message
             if getattr(message, 'refusal', None):
-                raise LLMError(f"Model refused to respond: {message.refusal}")
-                
+                first_error = first_error or LLMError(f"Model refused to respond: {message.refusal}")
             # Check if content exists
-            if not message.content:
-                raise LLMError(f"Empty response content from {self.model_name}")
-                
-            return message.content
+            elif not message.content:
+                first_error = first_error or LLMError(f"Empty response content from {self.model_name}")
+            else:
+                contents.append(message.content)
+        if not contents:
+            raise first_error
 
-        return await self._retry_with_exponential_backoff(_make_call)
+        if self.limiter is not None:
+            self.limiter.on_success(latency, response_headers)
+        return len(completion.choices), contents
 
     async def call_with_function(
         self,
@@ -155,7 +408,7 @@ class LLM:
         """Make a function call to the LLM with retry logic"""
         async def _make_function_call():
             try:
-                completion = await self.client.chat.completions.create(
+                completion, response_headers, latency = await self._create(
                     model=self.model_name,
                     messages=[
                         {"role": "system", "content": system_prompt},
@@ -166,9 +419,14 @@ class LLM:
                     function_call='auto',
                 )
                 response_message = completion.choices[0].message
-                return response_message.function_call.arguments
+                arguments = response_message.function_call.arguments
+                if self.limiter is not None:
+                    self.limiter.on_success(latency, response_headers)
+                return arguments
                 
+            except LLMError:
+                raise
             except Exception as e:
                 raise LLMError(f"Error in function call to {self.model_name}: {str(e)}")
 
-        return await self._retry_with_exponential_backoff(_make_function_call)
\ No newline at end of file
+        return await self._call_with_retries(_make_function_call)
\ No newline at end of file
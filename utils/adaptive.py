@@ -0,0 +1,81 @@
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from utils.coverage import expected_max_weights
+from utils.metrics import chrf_scores
+
+# Adaptive sampling: a strategy's `passes` becomes the most samples a source line can get.
+# Samples are drawn in waves; after each wave the samples of every still-active source are
+# scored with a cheap local metric, and a source stops once the expected best-of-n gain of
+# its last wave falls below `threshold` (in the metric's 0-100 points).
+
+ADAPTIVE_METRICS = ('chrf', 'agreement')
+
+def adaptive_settings(strategy_config: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """The `adaptive` section of a strategy with its defaults filled in, or None if it has none"""
+    adaptive = strategy_config.get('adaptive')
+    if adaptive is None:
+        return None
+    passes = strategy_config['passes']
+    wave_size = adaptive.get('wave_size', strategy_config.get('samples_per_request', 10))
+    settings = {
+        'wave_size': max(1, min(wave_size, passes)),
+        'min_samples': max(1, min(adaptive.get('min_samples', wave_size), passes)),
+        'threshold': float(adaptive.get('threshold', 0.5)),
+        'metric': adaptive.get('metric', 'chrf'),
+    }
+    if settings['metric'] not in ADAPTIVE_METRICS:
+        raise ValueError(f"Unknown adaptive metric {settings['metric']}; expected one of {', '.join(ADAPTIVE_METRICS)}")
+    return settings
+
+def best_of_gain(scores: np.ndarray, wave_size: int) -> float:
+    """
+    Expected best-of-n gain from the last `wave_size` of the len(scores) samples so far.
+
+    This is E[max of m] - E[max of m - wave_size] over the samples drawn, which shrinks as
+    further samples stop improving the best one, and serves as the estimate for the next wave.
+    """
+    count = len(scores)
+    if count < 2:
+        return float('inf')
+    curve = np.sort(scores) @ expected_max_weights(count)
+    return float(curve[-1] - curve[-1 - min(wave_size, count - 1)])
+
+class SampleScorer:
+    """
+    Scores of the samples of one source line, updated a wave at a time.
+
+    `chrf` scores each sample against the reference. `agreement` needs no reference and scores
+    each sample by its mean chrF against the other samples; the pairwise scores are kept, so a
+    wave only scores the pairs it adds.
+    """
+
+    def __init__(self, metric: str, reference: Optional[str] = None):
+        if metric == 'chrf' and reference is None:
+            raise ValueError("Adaptive sampling with metric chrf needs the reference of every source line")
+        self.metric = metric
+        self.reference = reference
+        self.samples: List[str] = []
+        self.scores = np.empty(0)
+        self.pairwise = np.empty((0, 0))
+
+    def add(self, samples: List[str]) -> np.ndarray:
+        """Scores of all samples so far, after adding `samples`"""
+        old = len(self.samples)
+        self.samples.extend(samples)
+        if self.metric == 'chrf':
+            self.scores = np.concatenate([self.scores, chrf_scores(samples, [self.reference] * len(samples))])
+            return self.scores
+
+        count = len(self.samples)
+        pairwise = np.zeros((count, count))
+        pairwise[:old, :old] = self.pairwise
+        # chrF is not symmetric: score the new rows against every sample and the old rows against the new ones
+        rows, columns = zip(*([(i, j) for i in range(old, count) for j in range(count)]
+                              + [(i, j) for i in range(old) for j in range(old, count)]))
+        pairwise[rows, columns] = chrf_scores([self.samples[i] for i in rows], [self.samples[j] for j in columns])
+        np.fill_diagonal(pairwise, 0.0)
+        self.pairwise = pairwise
+        self.scores = pairwise.sum(axis=1) / max(count - 1, 1)
+        return self.scores
@@ -0,0 +1,106 @@
+import os
+import json
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from utils.cache import ScoreCache, score_key
+
+class BleurtScorer:
+    """
+    BLEURT on the CPU from an ONNX export of a BLEURT checkpoint such as BLEURT-20-D12.
+
+    The checkpoint directory holds `model.onnx`, which takes int64 `input_ids`, `input_mask`
+    and `segment_ids` of shape (batch, sequence) with dynamic axes and returns one score per
+    row, the checkpoint's SentencePiece model (`sent_piece.model`) and optionally its
+    `bleurt_config.json`. Inputs are encoded as BLEURT does: [CLS] reference [SEP] candidate [SEP].
+
+    Each distinct (candidate, reference) pair is scored once: pairs are looked up in
+    `cache` first, the rest are sorted by length and batched so that each batch is padded
+    only to its own longest pair, and new scores are written back to `cache`.
+    """
+
+    def __init__(
+        self,
+        checkpoint: str,
+        batch_size: int = 64,
+        threads: Optional[int] = None,
+        cache: Optional[ScoreCache] = None,
+    ):
+        try:
+            import onnxruntime
+            import sentencepiece
+        except ImportError as e:
+            raise ImportError("BLEURT scoring needs onnxruntime and sentencepiece: pip install onnxruntime sentencepiece") from e
+
+        config = {}
+        config_file = os.path.join(checkpoint, 'bleurt_config.json')
+        if os.path.exists(config_file):
+            with open(config_file, 'r') as f:
+                config = json.load(f)
+        self.max_seq_length = config.get('max_seq_length', 512)
+        self.name = f"bleurt:{os.path.basename(os.path.normpath(checkpoint))}"
+        self.batch_size = batch_size
+        self.cache = cache
+
+        self.tokenizer = sentencepiece.SentencePieceProcessor(
+            model_file=os.path.join(checkpoint, f"{config.get('sp_model', 'sent_piece')}.model")
+        )
+        self.cls_id = self.tokenizer.piece_to_id('[CLS]')
+        self.sep_id = self.tokenizer.piece_to_id('[SEP]')
+
+        options = onnxruntime.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = onnxruntime.InferenceSession(
+            os.path.join(checkpoint, 'model.onnx'), options, providers=['CPUExecutionProvider']
+        )
+
+    def encode(self, candidate: str, reference: str) -> Tuple[List[int], List[int]]:
+        """Token ids and segment ids of one pair, truncating the longer side first to fit"""
+        reference_ids = self.tokenizer.encode(reference)
+        candidate_ids = self.tokenizer.encode(candidate)
+        while len(reference_ids) + len(candidate_ids) > self.max_seq_length - 3:
+            if len(reference_ids) > len(candidate_ids):
+                reference_ids.pop()
+            else:
+                candidate_ids.pop()
+        ids = [self.cls_id] + reference_ids + [self.sep_id] + candidate_ids + [self.sep_id]
+        segments = [0] * (len(reference_ids) + 2) + [1] * (len(candidate_ids) + 1)
+        return ids, segments
+
+    def _run(self, encoded: List[Tuple[List[int], List[int]]]) -> np.ndarray:
+        length = max(len(ids) for ids, _ in encoded)
+        input_ids = np.zeros((len(encoded), length), dtype=np.int64)
+        segment_ids = np.zeros((len(encoded), length), dtype=np.int64)
+        input_mask = np.zeros((len(encoded), length), dtype=np.int64)
+        for row, (ids, segments) in enumerate(encoded):
+            input_ids[row, :len(ids)] = ids
+            segment_ids[row, :len(ids)] = segments
+            input_mask[row, :len(ids)] = 1
+        outputs = self.session.run(None, {'input_ids': input_ids, 'input_mask': input_mask, 'segment_ids': segment_ids})
+        return np.asarray(outputs[0], dtype=np.float64).reshape(-1)
+
+    def score_pairs(self, pairs: List[Tuple[str, str]]) -> Dict[Tuple[str, str], float]:
+        """Scores of distinct (candidate, reference) pairs, from the cache where possible"""
+        keys = {pair: score_key(self.name, *pair) for pair in pairs}
+        cached = self.cache.get_many(keys.values()) if self.cache is not None else {}
+        scores = {pair: cached[key] for pair, key in keys.items() if key in cached}
+
+        missing = [pair for pair in pairs if pair not in scores]
+        encoded = sorted(((self.encode(*pair), pair) for pair in missing), key=lambda item: len(item[0][0]))
+        for start in range(0, len(encoded), self.batch_size):
+            batch = encoded[start:start + self.batch_size]
+            results = self._run([item[0] for item in batch]).tolist()
+            scores.update(zip((item[1] for item in batch), results))
+            if self.cache is not None:
+                self.cache.put_many([(keys[pair], score) for (_, pair), score in zip(batch, results)])
+        if pairs:
+            print(f"{self.name}: {len(pairs) - len(missing)} of {len(pairs)} distinct pairs cached, {len(missing)} scored")
+        return scores
+
+    def score(self, candidates: List[str], references: List[str]) -> np.ndarray:
+        """Score of every candidate against its reference, in input order"""
+        pairs = list(dict.fromkeys(zip(candidates, references)))
+        scores = self.score_pairs(pairs)
+        return np.array([scores[pair] for pair in zip(candidates, references)], dtype=np.float64)
@@ -0,0 +1,155 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+from typing import Dict, Iterable, List, Optional, Tuple
+
+def completion_key(api_name: str, system_prompt: str, prompt: str, temperature: float, sample_index: int) -> str:
+    """Content address of one completion"""
+    payload = json.dumps([api_name, system_prompt, prompt, float(temperature), sample_index], ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+class CompletionCache:
+    """
+    On-disk cache of LLM completions in SQLite (WAL mode), keyed by `completion_key`.
+
+    Entries older than `max_age_days` or beyond the `max_entries` most recently used
+    are evicted when the cache is opened. A read-only cache serves hits but never writes.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        read_only: bool = False,
+        max_entries: Optional[int] = None,
+        max_age_days: Optional[float] = None,
+    ):
+        self.path = path
+        self.read_only = read_only
+        if read_only:
+            self.conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+            return
+
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS completions ("
+            "key TEXT PRIMARY KEY, content TEXT NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS completions_accessed ON completions(accessed)")
+        self.conn.commit()
+        self.evict(max_entries, max_age_days)
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, str]:
+        keys = list(keys)
+        hits = {}
+        # Stay under SQLite's bound-parameter limit
+        for i in range(0, len(keys), 500):
+            chunk = keys[i:i + 500]
+            rows = self.conn.execute(
+                f"SELECT key, content FROM completions WHERE key IN ({','.join('?' * len(chunk))})", chunk
+            ).fetchall()
+            hits.update(rows)
+        if hits and not self.read_only:
+            now = time.time()
+            self.conn.executemany("UPDATE completions SET accessed = ? WHERE key = ?", [(now, key) for key in hits])
+            self.conn.commit()
+        return hits
+
+    def put_many(self, items: List[Tuple[str, str]]) -> None:
+        if self.read_only or not items:
+            return
+        now = time.time()
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO completions (key, content, created, accessed) VALUES (?, ?, ?, ?)",
+            [(key, content, now, now) for key, content in items]
+        )
+        self.conn.commit()
+
+    def evict(self, max_entries: Optional[int] = None, max_age_days: Optional[float] = None) -> int:
+        """Drop expired and least recently used entries, returning how many were removed"""
+        if self.read_only:
+            return 0
+        removed = 0
+        if max_age_days is not None:
+            cutoff = time.time() - max_age_days * 86400
+            removed += self.conn.execute("DELETE FROM completions WHERE created < ?", (cutoff,)).rowcount
+        if max_entries is not None:
+            removed += self.conn.execute(
+                "DELETE FROM completions WHERE key IN ("
+                "SELECT key FROM completions ORDER BY accessed DESC LIMIT -1 OFFSET ?)", (max_entries,)
+            ).rowcount
+        self.conn.commit()
+        return removed
+
+    def __len__(self) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM completions").fetchone()[0]
+
+    def close(self) -> None:
+        self.conn.close()
+
+def score_key(scorer: str, candidate: str, reference: str) -> str:
+    """Content address of one (candidate, reference) score from `scorer`"""
+    payload = json.dumps([scorer, candidate, reference], ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+class ScoreCache:
+    """
+    On-disk cache of metric scores in SQLite (WAL mode), keyed by `score_key`.
+
+    Scores are deterministic, so entries never expire; the cache is shared by all experiments.
+    """
+
+    def __init__(self, path: str, read_only: bool = False):
+        self.path = path
+        self.read_only = read_only
+        if read_only:
+            self.conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+            return
+
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS scores (key TEXT PRIMARY KEY, score REAL NOT NULL)")
+        self.conn.commit()
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, float]:
+        keys = list(keys)
+        hits = {}
+        for i in range(0, len(keys), 500):
+            chunk = keys[i:i + 500]
+            hits.update(self.conn.execute(
+                f"SELECT key, score FROM scores WHERE key IN ({','.join('?' * len(chunk))})", chunk
+            ).fetchall())
+        return hits
+
+    def put_many(self, items: List[Tuple[str, float]]) -> None:
+        if self.read_only or not items:
+            return
+        self.conn.executemany("INSERT OR REPLACE INTO scores (key, score) VALUES (?, ?)", items)
+        self.conn.commit()
+
+    def __len__(self) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM scores").fetchone()[0]
+
+    def close(self) -> None:
+        self.conn.close()
+
+def open_cache(cache_config: Dict, read_only: Optional[bool] = None) -> Optional[CompletionCache]:
+    """Open the completion cache described by the `cache` section of base.yaml, or None if disabled"""
+    if not cache_config or not cache_config.get('enabled', False):
+        return None
+    read_only = cache_config.get('read_only', False) if read_only is None else read_only
+    if read_only and not os.path.exists(cache_config['path']):
+        print(f"Warning: Read-only cache {cache_config['path']} does not exist. Running without cache.")
+        return None
+    return CompletionCache(
+        cache_config['path'],
+        read_only=read_only,
+        max_entries=cache_config.get('max_entries'),
+        max_age_days=cache_config.get('max_age_days'),
+    )
@@ -1,63 +1,143 @@
 import os
-import yaml
-from pathlib import Path
-from typing import Dict, Any
+import pickle
+import hashlib
+from typing import Dict, Any, List
 from string import Template
 
+from utils.languages import LanguageRegistry
+
+CONFIG_FILES = ('base', 'models', 'experiments', 'languages')
+
 def load_yaml(file_path: str) -> Dict[Any, Any]:
+    import yaml
+
     with open(file_path, 'r') as f:
         # Replace environment variables
         template = Template(f.read())
         yaml_str = template.safe_substitute(os.environ)
         return yaml.safe_load(yaml_str)
 
+def config_hash(config_dir: str) -> str:
+    """Hash of the config files and of the environment variables they substitute"""
+    digest = hashlib.sha256()
+    for name in CONFIG_FILES:
+        with open(f"{config_dir}/{name}.yaml", 'rb') as f:
+            text = f.read()
+        digest.update(text)
+        for match in Template.pattern.finditer(text.decode('utf-8')):
+            variable = match.group('named') or match.group('braced')
+            if variable:
+                digest.update(f"\0{variable}={os.environ.get(variable)}".encode('utf-8'))
+    return digest.hexdigest()[:24]
+
+def validate_config(base: Dict, models: Dict, experiments: Dict, languages: LanguageRegistry) -> None:
+    """Raise ValueError listing every inconsistency between the config files"""
+    errors: List[str] = []
+    for section in ('api', 'concurrency', 'paths', 'default_source'):
+        if section not in base:
+            errors.append(f"base.yaml has no {section} section")
+    strategies = experiments.get('strategies', {})
+    for strategy_id, strategy in strategies.items():
+        for key in ('passes', 'system_prompt', 'prompt_template'):
+            if key not in strategy:
+                errors.append(f"strategy {strategy_id} has no {key}")
+    groups = experiments.get('language_groups', {})
+    for group, group_languages in groups.items():
+        errors.extend(f"language group {group}: unknown language {language}" for language in group_languages if language not in languages)
+    for experiment_id, experiment in experiments.get('experiments', {}).items():
+        if experiment.get('model') not in models.get('models', {}):
+            errors.append(f"experiment {experiment_id}: unknown model {experiment.get('model')}")
+        if experiment.get('strategy') not in strategies:
+            errors.append(f"experiment {experiment_id}: unknown strategy {experiment.get('strategy')}")
+        if 'num_lines' not in experiment and 'line_ids' not in experiment:
+            errors.append(f"experiment {experiment_id}: needs num_lines or line_ids")
+        targets = experiment.get('target_languages')
+        if isinstance(targets, str):
+            if targets not in groups:
+                errors.append(f"experiment {experiment_id}: unknown language group {targets}")
+        else:
+            errors.extend(f"experiment {experiment_id}: unknown language {language}" for language in targets or () if language not in languages)
+    if errors:
+        raise ValueError("Invalid configuration:\n  " + "\n  ".join(errors))
+
+def load_config(config_dir: str, use_cache: bool = True) -> Dict[str, Any]:
+    """
+    The parsed and validated config files, keyed by file name.
+
+    Parsing is done once per config hash: the result is pickled to `<config_dir>/.cache/`
+    and later loads with the same files and environment read that instead.
+    """
+    cache_file = f"{config_dir}/.cache/config-{config_hash(config_dir)}.pickle" if use_cache else None
+    if cache_file is not None and os.path.exists(cache_file):
+        try:
+            with open(cache_file, 'rb') as f:
+                return pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError) as e:
+            print(f"Warning: ignoring unreadable config cache {cache_file}: {e}")
+
+    data = {name: load_yaml(f"{config_dir}/{name}.yaml") for name in CONFIG_FILES}
+    validate_config(data['base'], data['models'], data['experiments'], LanguageRegistry(data['languages']['languages']))
+    if cache_file is not None:
+        try:
+            os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+            temporary = f"{cache_file}.{os.getpid()}.tmp"
+            with open(temporary, 'wb') as f:
+                pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temporary, cache_file)
+        except OSError as e:
+            print(f"Warning: could not write config cache {cache_file}: {e}")
+    return data
+
 class Config:
-    def __init__(self, config_dir: str = "config"):
-        self.base = load_yaml(f"{config_dir}/base.yaml")
-        self.models = load_yaml(f"{config_dir}/models.yaml")
-        self.experiments = load_yaml(f"{config_dir}/experiments.yaml")
-    
+    def __init__(self, config_dir: str = "config", use_cache: bool = True):
+        data = load_config(config_dir, use_cache)
+        self.base = data['base']
+        self.models = data['models']
+        self.experiments = data['experiments']
+        self.languages = LanguageRegistry(data['languages']['languages'])
+
     def get_model_config(self, model_id: str) -> Dict[str, Any]:
         return self.models['models'][model_id]
-    
+
     def get_all_experiments(self) -> Dict[str, Any]:
         experiments = {}
         for experiment_id, experiment_config in self.experiments['experiments'].items():
             experiments[experiment_id] = experiment_config
         return experiments
-    
+
     def get_strategy_config(self, strategy_id: str) -> Dict[str, Any]:
         return self.experiments['strategies'][strategy_id]
 
     def get_experiment_config(self, experiment_id: str) -> Dict[str, Any]:
         exp_config = self.experiments['experiments'][experiment_id]
         strategy = self.experiments['strategies'][exp_config['strategy']]
-        
+
         # Resolve language group if specified
         if isinstance(exp_config['target_languages'], str):
             target_langs = self.experiments['language_groups'][exp_config['target_languages']]
         else:
             target_langs = exp_config['target_languages']
-            
+
+        # Optional explicit FLORES line ids; otherwise the first num_lines lines are used
+        line_ids = exp_config.get('line_ids')
+
         return {
             'base_path': self.base['paths']['base_flores'],
             'source_language': self.base['default_source']['language'],
             'source_code': self.base['default_source']['code'],
             'model': exp_config['model'],
             'temperature': exp_config.get('temperature', strategy['temperature']),
-            'num_lines': exp_config['num_lines'],
+            'num_lines': len(line_ids) if line_ids is not None else exp_config['num_lines'],
+            'line_ids': line_ids,
             'strategy': exp_config['strategy'],
             'target_languages': target_langs,
             'in_file': exp_config['in_file']
-        } 
+        }
 
     def get_language_code(self, language: str) -> str:
-        """Get the FLORES code for a given language name"""
-        code = self.base.get('language_codes', {}).get(language)
-        if not code:
-            raise ValueError(f"Language code not found for: {language}")
-        return code
+        """Get the FLORES code for a language given by name, ISO code or FLORES code"""
+        return self.languages.flores_code(language)
 
     def get_all_language_codes(self) -> Dict[str, str]:
         """Get all language codes mapping"""
-        return self.base.get('language_codes', {}) 
\ No newline at end of file
+        return self.languages.codes_by_name()
@@ -0,0 +1,177 @@
+import os
+import hashlib
+from functools import lru_cache
+from math import lgamma
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from utils.scores import counts_path, load_score_groups
+
+@lru_cache(maxsize=None)
+def expected_max_weights(group_size: int) -> np.ndarray:
+    """
+    (group_size, group_size) matrix W with W[i, n - 1] the probability that the i-th smallest
+    (from 0) of group_size scores is the maximum of a uniformly random subset of n of them.
+
+    That probability is C(i, n - 1) / C(group_size, n) for i >= n - 1 and 0 otherwise; it is
+    computed from log-factorials so that group sizes in the thousands do not overflow.
+    """
+    log_factorial = np.array([lgamma(m + 1) for m in range(group_size + 1)])
+    i = np.arange(group_size)[:, None]
+    n = np.arange(1, group_size + 1)[None, :]
+    valid = i >= n - 1
+    top = np.where(valid, i, n - 1)
+    log_weights = (log_factorial[top] - log_factorial[n - 1] - log_factorial[top - n + 1]
+                   - (log_factorial[group_size] - log_factorial[n] - log_factorial[group_size - n]))
+    weights = np.where(valid, np.exp(log_weights), 0.0)
+    weights.setflags(write=False)
+    return weights
+
+def expected_max_curves(groups: np.ndarray) -> np.ndarray:
+    """
+    Expected best score of n samples drawn without replacement from each group, for n = 1..k.
+
+    `groups` is a (groups, k) array of scores, one row per source line; the result has the same
+    shape, with column n - 1 holding the expectation for n samples.
+
+    Rows may be NaN-padded when sources got fewer samples (adaptive sampling stopped early):
+    a row of m scores gets its curve for n <= m and stays at its best score for n > m, the
+    value sampling further was judged not to improve. Rows are computed one product per
+    distinct m; rows without scores are dropped.
+    """
+    groups = np.asarray(groups, dtype=np.float64)
+    missing = np.isnan(groups)
+    if not missing.any():
+        return np.sort(groups, axis=1) @ expected_max_weights(groups.shape[1])
+
+    counts = groups.shape[1] - missing.sum(axis=1)
+    ordered = np.sort(groups, axis=1)  # NaN sorts last, so each row starts with its m scores
+    curves = np.empty_like(groups)
+    for count in np.unique(counts[counts > 0]):
+        rows = counts == count
+        curves[np.ix_(rows, np.arange(count))] = ordered[rows, :count] @ expected_max_weights(int(count))
+        curves[rows, count:] = ordered[rows, count - 1:count]
+    return curves[counts > 0]
+
+def curves_path(path: str) -> str:
+    """Sidecar file holding the curves of a score file"""
+    return f"{os.path.splitext(path)[0]}.curves.npz"
+
+def file_hash(path: str) -> str:
+    """Hash of a score file and of its group counts, if any"""
+    digest = hashlib.sha256()
+    for part in (path, counts_path(path)):
+        if not os.path.exists(part):
+            continue
+        with open(part, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+    return digest.hexdigest()
+
+def _file_version(path: str) -> Tuple[int, int]:
+    """Combined size and latest mtime of a score file and its group counts"""
+    stats = [os.stat(part) for part in (path, counts_path(path)) if os.path.exists(part)]
+    return sum(stat.st_size for stat in stats), max(stat.st_mtime_ns for stat in stats)
+
+def _cached_curves(path: str, group_size: int):
+    """Curves stored beside `path` if they were computed from its current content, else None"""
+    sidecar = curves_path(path)
+    if not os.path.exists(sidecar):
+        return None
+    with np.load(sidecar) as stored:
+        if int(stored['group_size']) != group_size:
+            return None
+        # Size and mtime are checked first so that unchanged files are not hashed
+        if (int(stored['size']), int(stored['mtime_ns'])) != _file_version(path) and str(stored['content_hash']) != file_hash(path):
+            return None
+        return stored['group_curves'], stored['mean_curve']
+
+def _save_curves(path: str, group_size: int, group_curves: np.ndarray, mean_curve: np.ndarray) -> None:
+    size, mtime_ns = _file_version(path)
+    temporary = f"{curves_path(path)}.tmp.npz"
+    np.savez(temporary, group_curves=group_curves, mean_curve=mean_curve, group_size=group_size,
+             size=size, mtime_ns=mtime_ns, content_hash=file_hash(path))
+    os.replace(temporary, curves_path(path))
+
+def score_file_curves(paths: List[str], group_size: int) -> Dict[str, Tuple[np.ndarray, np.ndarray]]:
+    """
+    (per-group curves, mean curve) of each score file, read from its `.curves.npz` sidecar when
+    the sidecar matches the file's content and group size.
+
+    Files without a valid sidecar are computed together in one matrix product where their groups
+    have the same width, and their sidecars are written.
+    """
+    curves = {}
+    stale = []
+    for path in paths:
+        cached = _cached_curves(path, group_size)
+        if cached is not None:
+            curves[path] = cached
+        else:
+            stale.append(path)
+
+    groups_per_file = [load_score_groups(path, group_size) for path in stale]
+    if len({groups.shape[1] for groups in groups_per_file}) == 1 and not any(np.isnan(groups).any() for groups in groups_per_file):
+        computed = np.split(expected_max_curves(np.vstack(groups_per_file)), np.cumsum([len(groups) for groups in groups_per_file])[:-1])
+    else:
+        computed = [expected_max_curves(groups) for groups in groups_per_file]
+    for path, group_curves in zip(stale, computed):
+        mean_curve = group_curves.mean(axis=0)
+        try:
+            _save_curves(path, group_size, group_curves, mean_curve)
+        except OSError as e:
+            print(f"Warning: could not write {curves_path(path)}: {e}")
+        curves[path] = (group_curves, mean_curve)
+    if paths:
+        print(f"Curves: {len(paths) - len(stale)} of {len(paths)} score files cached, {len(stale)} computed")
+    return curves
+
+def bootstrap_means(group_curves: np.ndarray, resamples: int = 10000, seed: int = 0, chunk: int = 2000) -> np.ndarray:
+    """
+    (resamples, k) mean curves of bootstrap resamples of the rows (source lines) of `group_curves`.
+
+    Each chunk of resamples is drawn as one (chunk, groups) index matrix, turned into per-row
+    counts of every group with a single bincount, so the resampled means are one
+    (chunk, groups) @ (groups, k) product instead of a loop over resamples.
+    """
+    group_curves = np.asarray(group_curves, dtype=np.float64)
+    groups = len(group_curves)
+    rng = np.random.default_rng(seed)
+    means = np.empty((resamples, group_curves.shape[1]))
+    for start in range(0, resamples, chunk):
+        rows = min(chunk, resamples - start)
+        indices = rng.integers(0, groups, (rows, groups)) + np.arange(rows)[:, None] * groups
+        counts = np.bincount(indices.ravel(), minlength=rows * groups).reshape(rows, groups)
+        means[start:start + rows] = counts @ group_curves / groups
+    return means
+
+def bootstrap_band(group_curves: np.ndarray, resamples: int = 10000, confidence: float = 95.0, seed: int = 0) -> Tuple[np.ndarray, np.ndarray]:
+    """Lower and upper percentile curves of the bootstrap distribution of the mean curve"""
+    tail = (100.0 - confidence) / 2
+    low, high = np.percentile(bootstrap_means(group_curves, resamples, seed), [tail, 100.0 - tail], axis=0)
+    return low, high
+
+def _bootstrap_band_job(job):
+    return bootstrap_band(*job)
+
+def bootstrap_bands(group_curves: Dict[str, np.ndarray], resamples: int = 10000, confidence: float = 95.0,
+                    seed: int = 0, workers: int = 1) -> Dict[str, Tuple[np.ndarray, np.ndarray]]:
+    """Bands of several languages, one language per worker process when `workers` > 1"""
+    jobs = [(curves, resamples, confidence, seed) for curves in group_curves.values()]
+    if workers > 1 and len(jobs) > 1:
+        from concurrent.futures import ProcessPoolExecutor
+
+        with ProcessPoolExecutor(max_workers=min(workers, len(jobs))) as pool:
+            bands = list(pool.map(_bootstrap_band_job, jobs))
+    else:
+        bands = [_bootstrap_band_job(job) for job in jobs]
+    return dict(zip(group_curves, bands))
+
+def average_bootstrap_band(group_curves: List[np.ndarray], resamples: int = 10000, confidence: float = 95.0,
+                           seed: int = 0) -> Tuple[np.ndarray, np.ndarray]:
+    """Band of the average of several languages' mean curves, resampling each language's groups independently"""
+    total = sum(bootstrap_means(curves, resamples, seed + i) for i, curves in enumerate(group_curves)) / len(group_curves)
+    tail = (100.0 - confidence) / 2
+    low, high = np.percentile(total, [tail, 100.0 - tail], axis=0)
+    return low, high
@@ -0,0 +1,116 @@
+import os
+import mmap
+import hashlib
+from typing import Dict, Iterable, List, Optional, Sequence, Union
+
+import numpy as np
+
+LineIds = Union[slice, range, Sequence[int], np.ndarray]
+
+# Newlines are located in chunks of this many bytes, so indexing a file never holds more
+# than one chunk's worth of temporaries.
+INDEX_CHUNK = 1 << 24
+
+def build_line_offsets(data) -> np.ndarray:
+    """Byte offset of the start of every line of `data` (a bytes-like object), followed by its length"""
+    starts = [np.zeros(1, dtype=np.int64)]
+    for start in range(0, len(data), INDEX_CHUNK):
+        chunk = np.frombuffer(data, dtype=np.uint8, count=min(INDEX_CHUNK, len(data) - start), offset=start)
+        starts.append(np.flatnonzero(chunk == ord('\n')).astype(np.int64) + start + 1)
+    offsets = np.concatenate(starts)
+    if offsets[-1] != len(data):
+        offsets = np.append(offsets, len(data))  # Last line has no trailing newline
+    return offsets
+
+class FloresCorpus:
+    """
+    Line-level access to FLORES+ files (`<base_flores>/<split>.<code>`) and other text corpora.
+
+    Each file is memory-mapped and indexed once by the byte offsets of its lines, so reading
+    any set of line ids decodes only those lines. Indexes are kept in memory and, if
+    `index_dir` is given, saved there and reused until the file's size or mtime changes.
+    Lines are returned stripped, as `utils.utils.read_lines` always has.
+    """
+
+    def __init__(self, base_flores: Optional[str] = None, index_dir: Optional[str] = None, split: str = 'devtest'):
+        self.base_flores = base_flores
+        self.index_dir = index_dir
+        self.split = split
+        self._files: Dict[str, tuple] = {}
+
+    def path(self, code: str) -> str:
+        if self.base_flores is None:
+            raise ValueError("FloresCorpus has no base_flores to resolve language codes against")
+        return os.path.join(self.base_flores, f"{self.split}.{code}")
+
+    def _index_path(self, path: str) -> str:
+        digest = hashlib.sha1(os.path.abspath(path).encode('utf-8')).hexdigest()[:16]
+        return os.path.join(self.index_dir, f"{os.path.basename(path)}.{digest}.npz")
+
+    def _open(self, path: str):
+        """(memory map, line offsets) of a file, indexing it if needed"""
+        stat = os.stat(path)
+        version = (stat.st_size, stat.st_mtime_ns)
+        cached = self._files.get(path)
+        if cached is not None and cached[0] == version:
+            return cached[1], cached[2]
+
+        with open(path, 'rb') as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if stat.st_size else b''
+        offsets = None
+        if self.index_dir is not None and os.path.exists(self._index_path(path)):
+            with np.load(self._index_path(path)) as stored:
+                if tuple(stored['version'].tolist()) == version:
+                    offsets = stored['offsets']
+        if offsets is None:
+            offsets = build_line_offsets(data)
+            if self.index_dir is not None:
+                os.makedirs(self.index_dir, exist_ok=True)
+                temporary = f"{self._index_path(path)}.tmp.npz"
+                np.savez(temporary, offsets=offsets, version=np.array(version, dtype=np.int64))
+                os.replace(temporary, self._index_path(path))
+        self._files[path] = (version, data, offsets)
+        return data, offsets
+
+    def num_lines(self, path: str) -> int:
+        return len(self._open(path)[1]) - 1
+
+    def read_file(self, path: str, line_ids: LineIds) -> List[str]:
+        """
+        Stripped lines of `path` at `line_ids`, in the order given.
+
+        A slice is clipped to the file like a list slice; explicit ids must exist.
+        """
+        data, offsets = self._open(path)
+        count = len(offsets) - 1
+        if isinstance(line_ids, slice):
+            line_ids = range(*line_ids.indices(count))
+        lines = []
+        for line_id in line_ids:
+            if not 0 <= line_id < count:
+                raise IndexError(f"Line {line_id} out of range for {path} ({count} lines)")
+            lines.append(data[offsets[line_id]:offsets[line_id + 1]].decode('utf-8').strip())
+        return lines
+
+    def lines(self, code: str, line_ids: LineIds) -> List[str]:
+        """Lines of the FLORES file of one language code"""
+        return self.read_file(self.path(code), line_ids)
+
+    def lines_many(self, codes: Iterable[str], line_ids: LineIds) -> Dict[str, List[str]]:
+        """The same lines of the FLORES files of several language codes"""
+        if not isinstance(line_ids, slice):
+            line_ids = list(line_ids)
+        return {code: self.lines(code, line_ids) for code in codes}
+
+_corpora: Dict[tuple, FloresCorpus] = {}
+
+def open_corpus(base_flores: Optional[str] = None, index_dir: Optional[str] = None) -> FloresCorpus:
+    """The process-wide FloresCorpus for a FLORES directory and index directory"""
+    key = (base_flores, index_dir)
+    if key not in _corpora:
+        _corpora[key] = FloresCorpus(base_flores, index_dir)
+    return _corpora[key]
+
+def source_line_ids(num_lines: int, line_ids: Optional[Sequence[int]] = None) -> LineIds:
+    """Line ids an experiment reads: its `line_ids` if set, else its first `num_lines` lines"""
+    return list(line_ids) if line_ids is not None else slice(0, num_lines)
@@ -0,0 +1,55 @@
+import os
+import json
+from typing import Dict, Tuple, Any
+
+def journal_path(out_file: str) -> str:
+    return f"{os.path.splitext(out_file)[0]}.journal"
+
+class CallJournal:
+    """
+    Append-only JSONL record of completed calls for one output file, keyed by (source index, pass index).
+
+    The first line holds the run metadata. Each completed call is written and flushed as it lands,
+    so an interrupted run can be resumed by replaying the journal and issuing only the missing calls.
+    """
+
+    def __init__(self, path: str, metadata: Dict[str, Any], resume: bool = False):
+        self.path = path
+        self.entries: Dict[Tuple[int, int], str] = {}
+        if resume and os.path.exists(path):
+            self._load(metadata)
+        else:
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(json.dumps({'metadata': metadata}, ensure_ascii=False) + "\n")
+        self.file = open(path, 'a', encoding='utf-8')
+
+    def _load(self, metadata: Dict[str, Any]) -> None:
+        with open(self.path, 'r', encoding='utf-8') as f:
+            lines = f.readlines()
+        if not lines or json.loads(lines[0]).get('metadata') != metadata:
+            print(f"Warning: Journal {self.path} was written for a different run. Starting over.")
+            with open(self.path, 'w', encoding='utf-8') as f:
+                f.write(json.dumps({'metadata': metadata}, ensure_ascii=False) + "\n")
+            return
+        for line in lines[1:]:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # Skip a line torn by a crash mid-write
+            self.entries[(entry['source'], entry['pass'])] = entry['text']
+        print(f"Resuming from {self.path}: {len(self.entries)} completed calls")
+
+    def get(self, source_index: int, pass_index: int):
+        return self.entries.get((source_index, pass_index))
+
+    def record(self, source_index: int, pass_index: int, text: str) -> None:
+        self.file.write(json.dumps({'source': source_index, 'pass': pass_index, 'text': text}, ensure_ascii=False) + "\n")
+        self.file.flush()
+
+    def close(self) -> None:
+        self.file.close()
+
+    def remove(self) -> None:
+        """Delete the journal once its output file has been written"""
+        self.close()
+        os.remove(self.path)
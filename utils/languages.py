@@ -0,0 +1,41 @@
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+class Language(NamedTuple):
+    name: str
+    flores: str
+    iso: Tuple[str, ...] = ()
+    aliases: Tuple[str, ...] = ()
+
+class LanguageRegistry:
+    """
+    The languages of config/languages.yaml, looked up by name, alias, ISO code or FLORES code.
+
+    Every key is indexed case-insensitively once, so each lookup is a single dict access.
+    """
+
+    def __init__(self, entries: List[Dict[str, Any]]):
+        self.languages: List[Language] = []
+        self._index: Dict[str, Language] = {}
+        for entry in entries:
+            language = Language(entry['name'], entry['flores'], tuple(entry.get('iso', ())), tuple(entry.get('aliases', ())))
+            self.languages.append(language)
+            for key in (language.name, language.flores, *language.iso, *language.aliases):
+                previous = self._index.setdefault(key.lower(), language)
+                if previous is not language:
+                    raise ValueError(f"{key} names both {previous.name} and {language.name} in the language registry")
+
+    def get(self, key: str) -> Optional[Language]:
+        return self._index.get(key.lower())
+
+    def __contains__(self, key: str) -> bool:
+        return key.lower() in self._index
+
+    def flores_code(self, key: str) -> str:
+        """FLORES code of a language given by any of its keys"""
+        language = self.get(key)
+        if language is None:
+            raise ValueError(f"Language code not found for: {key}")
+        return language.flores
+
+    def codes_by_name(self) -> Dict[str, str]:
+        return {language.name: language.flores for language in self.languages}
@@ -0,0 +1,181 @@
+import re
+from collections import Counter
+from typing import Dict, List, Tuple, Callable
+
+import numpy as np
+
+# Sentence-level lexical metrics compatible with sacreBLEU's defaults (chrF++ with
+# char order 6, word order 2 and beta 2; BLEU with the 13a tokenizer and exp smoothing;
+# case-insensitive TER). Statistics are computed once per distinct string or pair, since
+# pass@n references repeat every line n times and candidates often repeat too, and the
+# final scores are computed from the statistics as arrays.
+
+_PUNCTUATION = set('!"#$%&\'()*+,-./:;<=>?@[\\]^_`{|}~')
+
+_TOKENIZE_13A = [
+    (re.compile(r'([\{-\~\[-\` -\&\(-\+\:-\@\/])'), r' \1 '),
+    (re.compile(r'([^0-9])([\.,])'), r'\1 \2 '),
+    (re.compile(r'([\.,])([^0-9])'), r' \1 \2'),
+    (re.compile(r'([0-9])(-)'), r'\1 \2 '),
+]
+
+# Han, kana and full-width characters; languages written without spaces get them split into
+# single tokens for BLEU, as sacreBLEU's zh tokenizer does
+_CJK = re.compile(r'([⺀-鿿가-힯豈-﫿＀-￯])')
+CHARACTER_TOKENIZED_LANGUAGES = {'Mandarin Chinese', 'Japanese', 'Chinese'}
+
+def ngrams(tokens, n: int) -> Counter:
+    """Counts of the n-grams of a token list (or of a string's characters) as tuples"""
+    return Counter(zip(*[tokens[k:] for k in range(n)]))
+
+def tokenize_13a(line: str, split_characters: bool = False) -> List[str]:
+    line = line.replace('<skipped>', '').replace('-\n', '').replace('\n', ' ')
+    if '&' in line:
+        line = line.replace('&quot;', '"').replace('&amp;', '&').replace('&lt;', '<').replace('&gt;', '>')
+    if split_characters:
+        line = _CJK.sub(r' \1 ', line)
+    line = f" {line} "
+    for pattern, replacement in _TOKENIZE_13A:
+        line = pattern.sub(replacement, line)
+    return line.split()
+
+def _chrf_words(line: str) -> List[str]:
+    """Whitespace tokens with one leading or trailing punctuation mark split off"""
+    words = []
+    for word in line.split():
+        if len(word) > 1 and word[-1] in _PUNCTUATION:
+            words += [word[:-1], word[-1]]
+        elif len(word) > 1 and word[0] in _PUNCTUATION:
+            words += [word[0], word[1:]]
+        else:
+            words.append(word)
+    return words
+
+class _Memo(dict):
+    """Dict computing missing values with `function`, for per-distinct-string statistics"""
+
+    def __init__(self, function: Callable):
+        super().__init__()
+        self.function = function
+
+    def __missing__(self, key):
+        value = self[key] = self.function(key)
+        return value
+
+def _pair_statistics(candidates: List[str], references: List[str], statistics: Callable, width: int) -> np.ndarray:
+    """(len(candidates), width) array of `statistics(candidate, reference)`, computed once per distinct pair"""
+    pairs = _Memo(lambda pair: statistics(*pair))
+    result = np.empty((len(candidates), width), dtype=np.int64)
+    for i, pair in enumerate(zip(candidates, references)):
+        result[i] = pairs[pair]
+    return result
+
+def chrf_scores(candidates: List[str], references: List[str], char_order: int = 6, word_order: int = 2, beta: float = 2.0) -> np.ndarray:
+    """Sentence-level chrF++ (chrF with word n-grams) on a 0-100 scale"""
+    order = char_order + word_order
+
+    def extract(line: str) -> List[Counter]:
+        characters = ''.join(line.split())
+        words = _chrf_words(line)
+        return ([ngrams(characters, n) for n in range(1, char_order + 1)]
+                + [ngrams(words, n) for n in range(1, word_order + 1)])
+
+    extracted = _Memo(extract)
+
+    def statistics(candidate: str, reference: str) -> List[int]:
+        row = []
+        for hyp, ref in zip(extracted[candidate], extracted[reference]):
+            row += [sum(hyp.values()), sum(ref.values()), sum((hyp & ref).values())]
+        return row
+
+    stats = _pair_statistics(candidates, references, statistics, 3 * order).reshape(-1, order, 3).astype(np.float64)
+    n_hyp, n_ref, n_match = stats[:, :, 0], stats[:, :, 1], stats[:, :, 2]
+    # Precision and recall are averaged over the orders both sides have n-grams for
+    effective = (n_hyp > 0) & (n_ref > 0)
+    precision = np.where(effective, n_match / np.maximum(n_hyp, 1), 0.0).sum(axis=1)
+    recall = np.where(effective, n_match / np.maximum(n_ref, 1), 0.0).sum(axis=1)
+    effective_order = np.maximum(effective.sum(axis=1), 1)
+    precision, recall = precision / effective_order, recall / effective_order
+    factor = beta ** 2
+    denominator = factor * precision + recall
+    return np.where(denominator > 0, 100 * (1 + factor) * precision * recall / np.where(denominator > 0, denominator, 1), 0.0)
+
+def bleu_scores(candidates: List[str], references: List[str], max_order: int = 4, split_characters: bool = False) -> np.ndarray:
+    """Sentence-level BLEU on a 0-100 scale with exp smoothing and effective order"""
+    def extract(line: str) -> Tuple[int, List[Counter]]:
+        tokens = tokenize_13a(line, split_characters)
+        return len(tokens), [ngrams(tokens, n) for n in range(1, max_order + 1)]
+
+    extracted = _Memo(extract)
+
+    def statistics(candidate: str, reference: str) -> List[int]:
+        hyp_len, hyp = extracted[candidate]
+        ref_len, ref = extracted[reference]
+        matches = [sum((h & r).values()) for h, r in zip(hyp, ref)]
+        totals = [max(0, hyp_len - n) for n in range(max_order)]
+        return [hyp_len, ref_len] + matches + totals
+
+    stats = _pair_statistics(candidates, references, statistics, 2 + 2 * max_order).astype(np.float64)
+    hyp_len, ref_len = stats[:, 0], stats[:, 1]
+    matches, totals = stats[:, 2:2 + max_order], stats[:, 2 + max_order:]
+
+    # Orders with no candidate n-grams are left out; zero matches in an order are smoothed
+    # to 1 / 2^k of its total for the k-th such order, and no matches at all score 0
+    counted = totals > 0
+    zero = counted & (matches == 0)
+    smoothing = np.cumsum(zero, axis=1)
+    precision = np.where(zero, 1.0 / (np.exp2(smoothing) * np.maximum(totals, 1)), matches / np.maximum(totals, 1))
+    log_precision = np.where(counted, np.log(np.where(counted, precision, 1.0)), 0.0)
+    effective_order = counted.sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        brevity = np.where(hyp_len < ref_len, np.exp(1 - ref_len / np.maximum(hyp_len, 1)), 1.0)
+        score = 100 * brevity * np.exp(log_precision.sum(axis=1) / np.maximum(effective_order, 1))
+    return np.where((matches.sum(axis=1) > 0) & (effective_order > 0), score, 0.0)
+
+def _edit_distance(hyp: np.ndarray, ref: np.ndarray) -> int:
+    """Word-level Levenshtein distance, one vectorized DP row per candidate word"""
+    positions = np.arange(len(ref) + 1)
+    row = positions.copy()
+    for word in hyp:
+        substitution = row[:-1] + (ref != word)
+        current = np.empty_like(row)
+        current[0] = row[0] + 1
+        current[1:] = np.minimum(row[1:] + 1, substitution)
+        # Insertions chain along the row: current[j] = min over k <= j of current[k] + (j - k)
+        row = np.minimum.accumulate(current - positions) + positions
+    return int(row[-1])
+
+def ter_scores(candidates: List[str], references: List[str]) -> np.ndarray:
+    """
+    Sentence-level case-insensitive TER on a 0-100 scale (lower is better).
+
+    Only insertions, deletions and substitutions are counted; unlike sacreBLEU, block shifts
+    are not searched for, so scores can be higher for reordered candidates.
+    """
+    vocabulary = _Memo(lambda word: len(vocabulary))
+    encoded = _Memo(lambda line: np.array([vocabulary[word] for word in line.lower().split()], dtype=np.int64))
+
+    def statistics(candidate: str, reference: str) -> Tuple[int, int]:
+        return _edit_distance(encoded[candidate], encoded[reference]), len(encoded[reference])
+
+    stats = _pair_statistics(candidates, references, statistics, 2).astype(np.float64)
+    edits, ref_len = stats[:, 0], stats[:, 1]
+    return 100 * np.where(ref_len > 0, edits / np.maximum(ref_len, 1), (edits > 0).astype(np.float64))
+
+METRICS: Dict[str, Callable[..., np.ndarray]] = {
+    'chrf': chrf_scores,
+    'bleu': bleu_scores,
+    'ter': ter_scores,
+}
+
+def score_language(language: str, candidates: List[str], references: List[str], metrics: List[str]) -> Dict[str, np.ndarray]:
+    """Scores of every candidate against its reference for each of `metrics`"""
+    if len(candidates) != len(references):
+        raise ValueError(f"{language}: {len(candidates)} candidates but {len(references)} references")
+    scores = {}
+    for metric in metrics:
+        if metric == 'bleu':
+            scores[metric] = bleu_scores(candidates, references, split_characters=language in CHARACTER_TOKENIZED_LANGUAGES)
+        else:
+            scores[metric] = METRICS[metric](candidates, references)
+    return scores
@@ -0,0 +1,89 @@
+import re
+import json
+from typing import Dict, List, Optional
+
+# Packing: several source lines are translated in one request. The lines are numbered in
+# the prompt and the reply is asked for as a JSON object keyed by those numbers, so it can
+# be split back into one translation per line; lines the reply misses are sent on their own.
+# Multi-target requests are the same contract the other way round: one source line, several
+# target languages, and a JSON object keyed by language name.
+
+DEFAULT_PACK_TEMPLATE = (
+    "Translate each of the following {count} numbered texts from {in_lang} to {out_lang}.\n\n"
+    "{sources}\n\n"
+    "Return only a JSON object whose keys are the numbers \"1\" to \"{count}\" and whose values "
+    "are the translations of the texts with those numbers."
+)
+
+DEFAULT_MULTI_TARGET_TEMPLATE = (
+    "Translate the following text from {in_lang} into each of these languages: {languages}.\n\n"
+    "{source}\n\n"
+    "Return only a JSON object whose keys are exactly these language names and whose values "
+    "are the translations into those languages."
+)
+
+_FENCE = re.compile(r'^\s*```(?:json)?\s*(.*?)\s*```\s*$', re.DOTALL)
+
+def pack_prompt(template: str, in_lang: str, out_lang: str, sources: List[str]) -> str:
+    """Prompt asking for the translations of `sources`, numbered from 1"""
+    numbered = "\n".join(f"{number}. {' '.join(source.split())}" for number, source in enumerate(sources, 1))
+    return template.format(count=len(sources), in_lang=in_lang, out_lang=out_lang, sources=numbered)
+
+def _load_reply(text: str):
+    """The JSON value of a reply, optionally in a code fence and wrapped in a one-key object, or None"""
+    match = _FENCE.match(text)
+    try:
+        reply = json.loads(match.group(1) if match else text)
+    except json.JSONDecodeError:
+        return None
+    if isinstance(reply, dict) and len(reply) == 1 and isinstance(next(iter(reply.values())), (dict, list)):
+        reply = next(iter(reply.values()))  # e.g. {"translations": {...}}
+    return reply
+
+def _translation(value) -> Optional[str]:
+    """A reply entry as one stripped line, or None if it is not a usable translation"""
+    if isinstance(value, str) and value.strip() and "\n" not in value.strip():
+        return value.strip()
+    return None
+
+def parse_packed_reply(text: str, count: int) -> Dict[int, str]:
+    """
+    Translations of a packed reply by 0-based position, for the positions it answers.
+
+    The reply is a JSON object keyed by the numbers 1..count, optionally in a code fence; a
+    JSON list is accepted only if it has exactly `count` entries, since a shorter one cannot
+    be aligned. Entries that are missing, empty, not strings or span several lines are left out.
+    """
+    reply = _load_reply(text)
+    if isinstance(reply, list):
+        reply = {str(number): value for number, value in enumerate(reply, 1)} if len(reply) == count else {}
+    if not isinstance(reply, dict):
+        return {}
+    translations = {}
+    for number in range(1, count + 1):
+        translation = _translation(reply.get(str(number)))
+        if translation is not None:
+            translations[number - 1] = translation
+    return translations
+
+def multi_target_prompt(template: str, in_lang: str, languages: List[str], source: str) -> str:
+    """Prompt asking for the translations of `source` into every language of `languages`"""
+    return template.format(in_lang=in_lang, languages=", ".join(languages), source=source)
+
+def parse_multi_target_reply(text: str, languages: List[str]) -> Dict[str, str]:
+    """
+    Translations of a multi-target reply by language, for the languages it answers.
+
+    Keys are matched to `languages` case-insensitively; entries that are missing, empty,
+    not strings or span several lines are left out.
+    """
+    reply = _load_reply(text)
+    if not isinstance(reply, dict):
+        return {}
+    by_key = {str(key).strip().lower(): value for key, value in reply.items()}
+    translations = {}
+    for language in languages:
+        translation = _translation(by_key.get(language.lower()))
+        if translation is not None:
+            translations[language] = translation
+    return translations
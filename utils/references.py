@@ -0,0 +1,41 @@
+import os
+from typing import List, Tuple
+
+import numpy as np
+
+# Each reference is stored once, in `<stem>.refs`, with `<stem>.ref_counts.npy` holding how
+# many consecutive candidates of `<stem>.candidates` belong to it, so storage and reads scale
+# with the number of source lines rather than with sources × passes.
+
+def reference_paths(output_file: str) -> Tuple[str, str]:
+    """(.refs, .ref_counts.npy) paths for a generation output file"""
+    stem = os.path.splitext(output_file)[0]
+    return f"{stem}.refs", f"{stem}.ref_counts.npy"
+
+def sample_counts_path(output_file: str) -> str:
+    """Samples of each source line in a generation output file written by adaptive sampling"""
+    return f"{os.path.splitext(output_file)[0]}.sample_counts.npy"
+
+def write_references(refs_path: str, counts_path: str, references: List[str], counts: List[int]) -> None:
+    if len(references) != len(counts):
+        raise ValueError(f"{len(references)} references but {len(counts)} counts")
+    with open(refs_path, 'w', encoding='utf-8') as f:
+        f.write("".join(f"{reference}\n" for reference in references))
+    np.save(counts_path, np.asarray(counts, dtype=np.int32))
+
+def read_references(refs_path: str, counts_path: str) -> Tuple[List[str], np.ndarray]:
+    """Unique references and the number of candidates of each"""
+    with open(refs_path, 'r', encoding='utf-8') as f:
+        references = [line.rstrip('\n') for line in f]
+    counts = np.load(counts_path)
+    if len(references) != len(counts):
+        raise ValueError(f"{refs_path} has {len(references)} references but {counts_path} has {len(counts)} counts")
+    return references, counts
+
+def reference_index(counts: np.ndarray) -> np.ndarray:
+    """Index into the references of every candidate"""
+    return np.repeat(np.arange(len(counts)), counts)
+
+def candidate_references(references: List[str], counts: np.ndarray) -> List[str]:
+    """The reference of every candidate; repeated entries share one string"""
+    return [references[i] for i in reference_index(counts).tolist()]
@@ -0,0 +1,125 @@
+import os
+import sqlite3
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+def results_path(experiment_dir: str) -> str:
+    """Path of the results dataset of the experiment whose outputs are in `experiment_dir`"""
+    return os.path.join(experiment_dir, 'results.sqlite')
+
+class ResultsDB:
+    """
+    One experiment's results in SQLite (WAL mode), keyed by (language, source_id, pass_idx).
+
+    `candidates` holds one row per sample with the request latency and its share of the
+    request's tokens, `refs` the reference of every source line per language, and `scores`
+    one row per sample and metric. Rows are joined on their keys, never on line position.
+    """
+
+    def __init__(self, path: str, read_only: bool = False):
+        self.path = path
+        self.read_only = read_only
+        if read_only:
+            self.conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+            return
+
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.conn = sqlite3.connect(path, timeout=60)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS candidates (
+                language TEXT NOT NULL, source_id INTEGER NOT NULL, pass_idx INTEGER NOT NULL,
+                candidate TEXT NOT NULL, reference_id INTEGER NOT NULL,
+                latency REAL, prompt_tokens REAL, completion_tokens REAL,
+                PRIMARY KEY (language, source_id, pass_idx));
+            CREATE TABLE IF NOT EXISTS refs (
+                language TEXT NOT NULL, reference_id INTEGER NOT NULL, reference TEXT NOT NULL,
+                PRIMARY KEY (language, reference_id));
+            CREATE TABLE IF NOT EXISTS scores (
+                language TEXT NOT NULL, source_id INTEGER NOT NULL, pass_idx INTEGER NOT NULL,
+                metric TEXT NOT NULL, score REAL NOT NULL,
+                PRIMARY KEY (language, metric, source_id, pass_idx));
+        """)
+        self.conn.commit()
+
+    def add_candidates(self, rows: Iterable[Tuple[str, int, int, str, Optional[float], float, float]]) -> None:
+        """Insert (language, source_id, pass_idx, candidate, latency, prompt_tokens, completion_tokens) rows"""
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO candidates VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            [(language, source_id, pass_idx, candidate, source_id, latency, prompt_tokens, completion_tokens)
+             for language, source_id, pass_idx, candidate, latency, prompt_tokens, completion_tokens in rows]
+        )
+        self.conn.commit()
+
+    def add_references(self, language: str, references: List[str]) -> None:
+        """Store the references of a language, the i-th being the reference of source line i"""
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO refs VALUES (?, ?, ?)",
+            [(language, reference_id, reference) for reference_id, reference in enumerate(references)]
+        )
+        self.conn.commit()
+
+    def add_scores(self, language: str, metric: str, keys: List[Tuple[int, int]], scores: Iterable[float]) -> None:
+        """Store one score per (source_id, pass_idx) key"""
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO scores VALUES (?, ?, ?, ?, ?)",
+            [(language, source_id, pass_idx, metric, float(score)) for (source_id, pass_idx), score in zip(keys, scores)]
+        )
+        self.conn.commit()
+
+    def clear_language(self, language: str) -> None:
+        """Drop a language's candidates and scores before it is generated again from scratch"""
+        self.conn.execute("DELETE FROM candidates WHERE language = ?", (language,))
+        self.conn.execute("DELETE FROM scores WHERE language = ?", (language,))
+        self.conn.commit()
+
+    def languages(self) -> List[str]:
+        return [row[0] for row in self.conn.execute("SELECT DISTINCT language FROM candidates ORDER BY language")]
+
+    def metrics(self) -> List[str]:
+        return [row[0] for row in self.conn.execute("SELECT DISTINCT metric FROM scores ORDER BY metric")]
+
+    def pairs(self, language: str) -> Tuple[List[Tuple[int, int]], List[str], List[str]]:
+        """Keys, candidates and references of every sample of a language that has a reference"""
+        rows = self.conn.execute(
+            "SELECT c.source_id, c.pass_idx, c.candidate, r.reference FROM candidates c "
+            "JOIN refs r ON r.language = c.language AND r.reference_id = c.reference_id "
+            "WHERE c.language = ? ORDER BY c.source_id, c.pass_idx", (language,)
+        ).fetchall()
+        missing = self.conn.execute(
+            "SELECT COUNT(*) FROM candidates WHERE language = ?", (language,)
+        ).fetchone()[0] - len(rows)
+        if missing:
+            print(f"Warning: {missing} {language} candidates have no reference")
+        return [(row[0], row[1]) for row in rows], [row[2] for row in rows], [row[3] for row in rows]
+
+    def score_matrix(self, language: str, metric: str) -> np.ndarray:
+        """
+        (sources, passes) scores of a language, with NaN for samples that have no score.
+
+        Rows are source ids and columns pass indices, as stored, so gaps stay visible.
+        """
+        rows = self.conn.execute(
+            "SELECT source_id, pass_idx, score FROM scores WHERE language = ? AND metric = ?", (language, metric)
+        ).fetchall()
+        if not rows:
+            return np.empty((0, 0))
+        keys = np.array([(row[0], row[1]) for row in rows], dtype=np.int64)
+        sources, source_index = np.unique(keys[:, 0], return_inverse=True)
+        matrix = np.full((len(sources), keys[:, 1].max() + 1), np.nan)
+        matrix[source_index, keys[:, 1]] = [row[2] for row in rows]
+        return matrix
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """Mean score per language and metric"""
+        summary: Dict[str, Dict[str, float]] = {}
+        for language, metric, mean in self.conn.execute(
+            "SELECT language, metric, AVG(score) FROM scores GROUP BY language, metric ORDER BY language, metric"
+        ):
+            summary.setdefault(language, {})[metric] = mean
+        return summary
+
+    def close(self) -> None:
+        self.conn.close()
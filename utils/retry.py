@@ -0,0 +1,93 @@
+import os
+import json
+import time
+import random
+from typing import Optional
+
+class RetryPolicy:
+    """
+    Attempt limit, per-call deadline and decorrelated-jitter backoff for one logical call.
+
+    Each delay is drawn uniformly between `base_delay` and three times the previous delay,
+    capped at `max_delay`, so retries from many calls spread out instead of synchronizing.
+    """
+
+    def __init__(self, max_attempts: int = 6, base_delay: float = 1.0, max_delay: float = 60.0, deadline: float = 900.0):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+
+    def next_delay(self, previous: Optional[float] = None) -> float:
+        previous = previous or self.base_delay
+        return min(self.max_delay, random.uniform(self.base_delay, max(self.base_delay, previous * 3)))
+
+class RetryBudget:
+    """Caps retries across an experiment's calls at `minimum` plus `ratio` times the calls made"""
+
+    def __init__(self, ratio: float = 0.2, minimum: int = 50):
+        self.ratio = ratio
+        self.minimum = minimum
+        self.calls = 0
+        self.retries = 0
+
+    def on_call(self) -> None:
+        self.calls += 1
+
+    def can_retry(self) -> bool:
+        return self.retries < self.minimum + self.ratio * self.calls
+
+    def on_retry(self) -> None:
+        self.retries += 1
+
+class CircuitBreaker:
+    """
+    Stops calls to a model after `failure_threshold` consecutive hard failures.
+
+    Once open, calls fail immediately until `reset_timeout` seconds have passed; then calls
+    are let through again, and one more failure reopens the breaker while a success closes it.
+    Rate limits are not hard failures and never open the breaker.
+    """
+
+    def __init__(self, failure_threshold: int = 10, reset_timeout: float = 60.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+
+    @property
+    def is_open(self) -> bool:
+        return self.opened_at is not None and time.monotonic() - self.opened_at < self.reset_timeout
+
+    def on_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+
+    def on_failure(self) -> None:
+        self.failures += 1
+        if self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+
+def save_retry_state(path: str, budget: RetryBudget, breaker: CircuitBreaker) -> None:
+    """
+    Write the counts of `budget` and `breaker` to `path`, for load_retry_state in the next process.
+
+    driver.py runs an experiment's languages in one generate.py process after another; handing
+    the state on makes the budget and breaker span the experiment rather than one language.
+    """
+    open_for = breaker.reset_timeout - (time.monotonic() - breaker.opened_at) if breaker.opened_at is not None else None
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'calls': budget.calls, 'retries': budget.retries, 'failures': breaker.failures, 'open_for': open_for}, f)
+
+def load_retry_state(path: str, budget: RetryBudget, breaker: CircuitBreaker) -> None:
+    """Restore the counts saved by save_retry_state into `budget` and `breaker`, if `path` exists"""
+    if not os.path.exists(path):
+        return
+    with open(path, 'r', encoding='utf-8') as f:
+        state = json.load(f)
+    budget.calls = state['calls']
+    budget.retries = state['retries']
+    breaker.failures = state['failures']
+    if state['open_for'] is not None:
+        # Monotonic clocks are per process, so the open time travels as the time left open
+        breaker.opened_at = time.monotonic() - (breaker.reset_timeout - state['open_for'])
@@ -0,0 +1,149 @@
+import time
+import asyncio
+from typing import Dict, Optional, Any
+
+def _header(headers: Optional[Dict[str, Any]], name: str) -> Optional[float]:
+    """Read a numeric header case-insensitively, returning None if absent or malformed"""
+    if not headers:
+        return None
+    name = name.lower()
+    for key, value in headers.items():
+        if key.lower() == name:
+            try:
+                return float(value)
+            except (TypeError, ValueError):
+                return None
+    return None
+
+def cooldown_from_headers(headers: Optional[Dict[str, Any]], default: float = 60.0) -> float:
+    """Seconds until the X-RateLimit-Reset timestamp (epoch milliseconds), or `default`"""
+    reset_time = _header(headers, 'X-RateLimit-Reset')
+    if not reset_time:
+        return default
+    return max(1.0, (reset_time - time.time() * 1000) / 1000)
+
+class AdaptiveLimiter:
+    """
+    Bounds the number of in-flight requests to one provider and adapts the bound AIMD-style.
+
+    Until the first congestion signal the limit grows by one per success (slow start);
+    after that it grows additively (about +1 per limit's worth of successful requests).
+    It shrinks multiplicatively on 429s, on short-term latency inflation relative to the
+    long-term average latency, and when X-RateLimit-Remaining says fewer requests are
+    left than are in flight.
+    A rate limit pauses the whole pool until the reset time instead of each task sleeping
+    on its own.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        initial_in_flight: int = 8,
+        min_in_flight: int = 1,
+        max_in_flight: int = 64,
+        backoff: float = 0.5,
+        latency_tolerance: float = 2.0,
+    ):
+        self.name = name
+        self.min_limit = min_in_flight
+        self.max_limit = max_in_flight
+        self.limit = float(min(max(initial_in_flight, min_in_flight), max_in_flight))
+        self.backoff = backoff
+        self.latency_tolerance = latency_tolerance
+        self.in_flight = 0
+        self.base_latency: Optional[float] = None
+        self.avg_latency: Optional[float] = None
+        self._resume_at = 0.0
+        self._last_decrease = 0.0
+        self.slow_start = True
+        self._cond = asyncio.Condition()
+
+    @property
+    def paused_for(self) -> float:
+        return max(0.0, self._resume_at - time.monotonic())
+
+    async def wait_ready(self) -> None:
+        """Wait out any global cooldown"""
+        while self.paused_for > 0:
+            await asyncio.sleep(self.paused_for)
+
+    async def acquire(self) -> None:
+        while True:
+            await self.wait_ready()
+            async with self._cond:
+                if self.paused_for > 0:
+                    continue
+                if self.in_flight < int(self.limit):
+                    self.in_flight += 1
+                    return
+                # At the limit: some request is in flight and will notify on release
+                await self._cond.wait()
+
+    async def release(self) -> None:
+        async with self._cond:
+            self.in_flight -= 1
+            self._cond.notify_all()
+
+    async def __aenter__(self) -> 'AdaptiveLimiter':
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.release()
+
+    def pause(self, seconds: float) -> None:
+        """Stop handing out slots for `seconds`, extending any pause already in effect"""
+        self._resume_at = max(self._resume_at, time.monotonic() + seconds)
+
+    def _decrease(self, factor: float) -> None:
+        # Decrease at most once per observed round trip, so a burst of failures from
+        # requests that were all in flight together only counts once
+        now = time.monotonic()
+        if now - self._last_decrease < (self.avg_latency or 1.0):
+            return
+        self._last_decrease = now
+        self.slow_start = False
+        self.limit = max(float(self.min_limit), self.limit * factor)
+
+    def on_success(self, latency: float, headers: Optional[Dict[str, Any]] = None) -> None:
+        # Compare a short-term latency average with a long-term baseline, so the natural
+        # spread of completion latencies does not read as congestion but a sustained rise does
+        self.avg_latency = latency if self.avg_latency is None else 0.9 * self.avg_latency + 0.1 * latency
+        self.base_latency = latency if self.base_latency is None else 0.99 * self.base_latency + 0.01 * latency
+
+        remaining = _header(headers, 'X-RateLimit-Remaining')
+        if remaining is not None and remaining <= 0:
+            self.pause(cooldown_from_headers(headers, default=1.0))
+        if remaining is not None and remaining < self.in_flight:
+            self.limit = max(float(self.min_limit), min(self.limit, remaining + 1))
+            return
+
+        if self.avg_latency > self.latency_tolerance * self.base_latency:
+            self._decrease((1 + self.backoff) / 2)
+        elif self.limit < self.max_limit:
+            self.limit = min(float(self.max_limit), self.limit + (1 if self.slow_start else 1 / self.limit))
+
+    def on_rate_limit(self, cooldown: float, headers: Optional[Dict[str, Any]] = None) -> None:
+        self._decrease(self.backoff)
+        self.pause(cooldown)
+
+_limiters: Dict[str, AdaptiveLimiter] = {}
+
+def provider_of(api_name: str) -> str:
+    """Provider prefix of an OpenRouter api_name, e.g. `google` for google/gemini-2.0-flash-001"""
+    return api_name.split('/', 1)[0]
+
+def limiter_settings(concurrency: Dict[str, Any], provider: str, max_in_flight: Optional[int] = None) -> Dict[str, Any]:
+    """The `concurrency` settings from base.yaml with any overrides under `providers` for `provider` applied,
+    and `max_in_flight` in place of the configured one if given"""
+    settings = {key: value for key, value in concurrency.items() if key != 'providers'}
+    settings.update((concurrency.get('providers') or {}).get(provider) or {})
+    if max_in_flight is not None:
+        settings['max_in_flight'] = max_in_flight
+    return settings
+
+def get_limiter(name: str, **settings) -> AdaptiveLimiter:
+    """Return the process-wide limiter for `name`, creating it with `settings` on first use"""
+    if name not in _limiters:
+        _limiters[name] = AdaptiveLimiter(name, **settings)
+    return _limiters[name]
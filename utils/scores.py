@@ -0,0 +1,92 @@
+import os
+from typing import List
+
+import numpy as np
+
+# Scores are kept as float32 .npy files next to the .eval text files and memory-mapped
+# by readers; a text file is parsed once and converted on first read.
+
+def binary_path(path: str) -> str:
+    """Path of the .npy store for a text score file"""
+    return f"{os.path.splitext(path)[0]}.npy"
+
+def parse_score_text(path: str) -> np.ndarray:
+    """Scores of a text file with one score per line, skipping non-numeric lines"""
+    scores: List[float] = []
+    with open(path, 'r') as file:
+        for line in file:
+            try:
+                scores.append(float(line.strip()))
+            except ValueError:
+                continue  # Skip non-numeric lines
+    return np.array(scores, dtype=np.float32)
+
+def save_scores(path: str, scores: np.ndarray) -> str:
+    """Write the .npy store for the text score file `path`, returning its path"""
+    target = binary_path(path)
+    temporary = f"{target}.tmp.npy"
+    np.save(temporary, np.asarray(scores, dtype=np.float32))
+    os.replace(temporary, target)
+    return target
+
+def load_scores(path: str) -> np.ndarray:
+    """
+    Scores of a score file as a read-only float32 array, memory-mapped from its .npy store.
+
+    The store is (re)built from the text file when it is missing or older than the text
+    file; if only the store exists it is used on its own. Where the store cannot be written,
+    the parsed text is returned instead.
+    """
+    store = binary_path(path)
+    if os.path.exists(store) and (not os.path.exists(path) or os.path.getmtime(store) >= os.path.getmtime(path)):
+        return np.load(store, mmap_mode='r')
+    scores = parse_score_text(path)
+    try:
+        save_scores(path, scores)
+    except OSError as e:
+        print(f"Warning: could not write {store}: {e}")
+        return scores
+    return np.load(store, mmap_mode='r')
+
+def counts_path(path: str) -> str:
+    """Path of the number of samples of each source line, for score files of ragged groups"""
+    return f"{os.path.splitext(path)[0]}.counts.npy"
+
+def save_group_counts(path: str, counts) -> None:
+    np.save(counts_path(path), np.asarray(counts, dtype=np.int32))
+
+def pad_groups(scores: np.ndarray, counts: np.ndarray, width: int) -> np.ndarray:
+    """(len(counts), width) array of consecutive groups of `counts[i]` scores, NaN-padded on the right"""
+    counts = np.asarray(counts, dtype=np.int64)
+    if counts.sum() != len(scores) or (counts > width).any():
+        raise ValueError(f"{len(scores)} scores do not split into groups of {counts.min()}-{counts.max()} of at most {width}")
+    groups = np.full((len(counts), width), np.nan)
+    rows = np.repeat(np.arange(len(counts)), counts)
+    columns = np.arange(len(scores)) - np.repeat(np.cumsum(counts) - counts, counts)
+    groups[rows, columns] = scores
+    return groups
+
+def load_score_groups(path: str, passes: int) -> np.ndarray:
+    """
+    Scores of a score file as a (sources, passes) array.
+
+    If the file has a `.counts.npy` beside it (sources sampled adaptively), source i has
+    counts[i] scores and its row is NaN-padded; otherwise groups are `passes` long.
+    """
+    if os.path.exists(counts_path(path)):
+        return pad_groups(load_scores(path), np.load(counts_path(path)), passes)
+    return load_score_matrix(path, passes)
+
+def load_score_matrix(path: str, passes: int) -> np.ndarray:
+    """
+    Scores of a score file as a (sources, passes) array.
+
+    A trailing incomplete group is dropped with a warning, unless it is the only group.
+    """
+    scores = load_scores(path)
+    if len(scores) < passes:
+        return scores.reshape(1, -1)
+    complete = len(scores) - len(scores) % passes
+    if complete < len(scores):
+        print(f"Warning: dropping {len(scores) - complete} scores after the last complete group of {passes} in {path}")
+    return scores[:complete].reshape(-1, passes)
@@ -0,0 +1,146 @@
+import os
+import json
+import time
+import uuid
+from typing import Dict, Any, Optional, List
+
+class CallStats:
+    """Accumulates what happened while serving one request for one or more samples"""
+
+    def __init__(self):
+        self.attempts = 0
+        self.queue_wait = 0.0
+        self.latency = 0.0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    def add_usage(self, usage: Any) -> None:
+        if usage is None:
+            return
+        self.prompt_tokens += getattr(usage, 'prompt_tokens', 0) or 0
+        self.completion_tokens += getattr(usage, 'completion_tokens', 0) or 0
+
+class Telemetry:
+    """
+    Writes one JSONL record per request (or per cache/journal hit) of a generation run.
+    A multi-target request is recorded under its first language; its other languages get
+    `multi_target` records with their samples and share of the tokens.
+
+    Records of a run share a `run_id`, so several processes can append to the same file
+    and `summarize_telemetry` can pick out one run afterwards.
+    """
+
+    def __init__(self, path: str, run_id: Optional[str] = None):
+        self.path = path
+        self.run_id = run_id or new_run_id()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.file = open(path, 'a', encoding='utf-8')
+
+    def record(
+        self,
+        call: Dict[str, Any],
+        passes: List[int],
+        start: float,
+        stats: Optional[CallStats] = None,
+        source: str = 'request',
+        error: Optional[BaseException] = None,
+    ) -> None:
+        stats = stats or CallStats()
+        self.file.write(json.dumps({
+            'run_id': self.run_id,
+            'model': call['model'],
+            'language': call.get('language'),
+            'source_index': call.get('source_index'),
+            'passes': passes,
+            'source': source,
+            'attempts': stats.attempts,
+            'queue_wait': round(stats.queue_wait, 4),
+            'latency': round(stats.latency, 4),
+            'prompt_tokens': stats.prompt_tokens,
+            'completion_tokens': stats.completion_tokens,
+            'error': type(error).__name__ if error is not None else None,
+            'start': start,
+            'end': time.time(),
+        }, ensure_ascii=False) + "\n")
+        self.file.flush()
+
+    def close(self) -> None:
+        self.file.close()
+
+def new_run_id() -> str:
+    return f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+
+def summarize_telemetry(path: str, run_id: str, prices: Dict[str, Dict[str, float]]) -> Dict[str, Any]:
+    """
+    Aggregate the records of one run per language: throughput, tokens and estimated cost.
+
+    `prices` maps an api_name to its `prompt_price`/`completion_price` in USD per million tokens.
+    """
+    languages: Dict[str, Dict[str, Any]] = {}
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            record = json.loads(line)
+            if record['run_id'] != run_id:
+                continue
+            summary = languages.setdefault(record['language'], {
+                'requests': 0, 'attempts': 0, 'samples': 0, 'cached_samples': 0, 'errors': 0,
+                'prompt_tokens': 0, 'completion_tokens': 0, 'estimated_cost': 0.0,
+                'latency': 0.0, 'queue_wait': 0.0, 'start': record['start'], 'end': record['end'],
+            })
+            if record['source'] == 'request':
+                summary['requests'] += 1
+                summary['attempts'] += record['attempts']
+                summary['latency'] += record['latency']
+                summary['queue_wait'] += record['queue_wait']
+            if record['error']:
+                summary['errors'] += 1
+            elif record['source'] in ('request', 'multi_target'):
+                summary['samples'] += len(record['passes'])
+            else:
+                summary['cached_samples'] += len(record['passes'])
+            summary['prompt_tokens'] += record['prompt_tokens']
+            summary['completion_tokens'] += record['completion_tokens']
+            price = prices.get(record['model'], {})
+            summary['estimated_cost'] += (
+                record['prompt_tokens'] * price.get('prompt_price', 0.0)
+                + record['completion_tokens'] * price.get('completion_price', 0.0)
+            ) / 1e6
+            summary['start'] = min(summary['start'], record['start'])
+            summary['end'] = max(summary['end'], record['end'])
+
+    for summary in languages.values():
+        wall_time = max(summary['end'] - summary['start'], 1e-9)
+        summary['wall_time'] = wall_time
+        summary['samples_per_sec'] = summary['samples'] / wall_time
+        summary['mean_latency'] = summary['latency'] / max(summary['requests'], 1)
+        summary['mean_queue_wait'] = summary['queue_wait'] / max(summary['requests'], 1)
+        for key in ('start', 'end', 'latency', 'queue_wait'):
+            del summary[key]
+
+    total = {key: sum(summary[key] for summary in languages.values())
+             for key in ('requests', 'attempts', 'samples', 'cached_samples', 'errors',
+                         'prompt_tokens', 'completion_tokens', 'estimated_cost')}
+    return {'run_id': run_id, 'languages': languages, 'total': total}
+
+def model_prices(models_config: Dict[str, Any]) -> Dict[str, Dict[str, float]]:
+    """Prices from models.yaml keyed by api_name"""
+    return {
+        model['api_name']: {key: model[key] for key in ('prompt_price', 'completion_price') if key in model}
+        for model in models_config['models'].values()
+    }
+
+def write_summary(path: str, run_id: str, prices: Dict[str, Dict[str, float]]) -> Dict[str, Any]:
+    """Summarize one run of the telemetry file at `path`, print it and save it beside as JSON"""
+    summary = summarize_telemetry(path, run_id, prices)
+    with open(f"{os.path.splitext(path)[0]}_summary_{run_id}.json", 'w', encoding='utf-8') as f:
+        json.dump(summary, f, indent=2, ensure_ascii=False)
+
+    print(f"Telemetry summary for run {run_id}:")
+    for language, stats in sorted(summary['languages'].items()):
+        print(f"  {language}: {stats['samples']} samples ({stats['cached_samples']} cached) in {stats['requests']} requests, "
+              f"{stats['samples_per_sec']:.1f} samples/s, {stats['prompt_tokens']}+{stats['completion_tokens']} tokens, "
+              f"~${stats['estimated_cost']:.4f}, {stats['errors']} errors")
+    total = summary['total']
+    print(f"  Total: {total['samples']} samples in {total['requests']} requests ({total['attempts']} attempts), "
+          f"{total['prompt_tokens']}+{total['completion_tokens']} tokens, ~${total['estimated_cost']:.4f}")
+    return summary
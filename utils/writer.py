@@ -0,0 +1,31 @@
+from typing import Dict
+
+class OrderedWriter:
+    """
+    Streams results to an output file in call order as they arrive out of order.
+
+    Results that arrive ahead of the next index to be written wait in a reorder buffer,
+    so memory is bounded by how far the producer runs ahead, not by the total output.
+    The file is the header, a blank line, then one stripped result per line.
+    """
+
+    def __init__(self, path: str, header: str):
+        self.path = path
+        self.next_index = 0
+        self.pending: Dict[int, str] = {}
+        self.file = open(path, 'w', encoding='utf-8')
+        self.file.write(header + "\n\n")
+
+    def add(self, index: int, result: str) -> None:
+        self.pending[index] = result
+        while self.next_index in self.pending:
+            if self.next_index > 0:
+                self.file.write("\n")
+            self.file.write(self.pending.pop(self.next_index).strip())
+            self.next_index += 1
+        self.file.flush()
+
+    def close(self) -> None:
+        self.file.close()
+        if self.pending:
+            raise ValueError(f"{len(self.pending)} results for {self.path} are missing earlier results and were not written")